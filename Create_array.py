@@ -2,11 +2,14 @@
 '''
 Creates a c file with arrays of bytes from memory locations in the hex file.
 The purpose is to embed an image into your new project. I used it to embed a bootloader into image of the application.
+It can also be imported: write_c_arrays does the same for an image parsed by HexParser.
 '''
 
 from os.path import sys
+from contextlib import nullcontext
 import os
-from intelHexParser import HexParser
+from intelHexParser import HexParser, AddressError
+from hexStats import HexStats
 
 
 # configuration
@@ -15,109 +18,125 @@ bytesPerPage = 2048
 max_valid_address = 0x1FC00BF0     # 0x2A800*2
 # end of configuration
 
-
-if len(sys.argv) < 2:
-    sys.exit('Usage: %s  <input_file_name.hex> [<output_file_name.c>]' % sys.argv[0])
-
-if not os.path.exists(sys.argv[1]):
-    sys.exit('ERROR: %s was not found!' % sys.argv[1])
-
-in_filename = sys.argv[1]
-
-out_fileName = "hex_to_c.c"
-if len(sys.argv) > 2:
-    out_fileName = sys.argv[2]
-
-
-lines = HexParser(in_filename, page_size=bytesPerPage)
-firstAddress = lines.get_start_addr()
-lastAddress = lines.get_end_addr()
-
-print("first address: 0x%0.6X" % firstAddress)
-print("last address detected: 0x%0.6X" % lastAddress)
-
-if lastAddress > max_valid_address:
-    lastAddress = max_valid_address
-    print("last address considered: 0x%0.6X" % lastAddress)
-
-print("\nWriting " + outputFileName)
-f = open(outputFileName, 'w')
-f.write("#include \"hex_to_c.h\"\n\n")
-
-byteDataFinished = False
-dataToWrite = []
-pageAddressMSW = []
-pageNumber = []
-
-
-# write program flash data (byte arrays)
-for page_addr in range(firstAddress, lastAddress, bytesPerPage):
-    blank_counter = 0
-
-    for dataAddr in range(page_addr, page_addr + bytesPerPage):
-        try:
-            lines.get_byte(dataAddr)
-        except:
-            blank_counter += 1
-
-    if blank_counter < bytesPerPage:
-        print("writing page: %d" %(page_addr / bytesPerPage))
-        # if the whole page is not empty
-        process = False
-        phantom_byte_index = 0  # used to locate the phantom bytes within the hex file(every fourth)
-        for dataAddr in range(page_addr, page_addr + bytesPerPage):
-
-            if byteDataFinished:
-                dataToWrite.append(",\n")
-                byteDataFinished = False
-
-            if not process:
-                process = True
-                pageAddressMSW.append("%0.4X" % (page_addr >> 16))
-                pageNumber.append(page_addr / bytesPerPage)
-                dataToWrite = ["const uint8_t fData" + str(len(pageAddressMSW)-1) + "[] =\n", "{\n"]
-
-            try:
-                value = lines.get_byte(dataAddr)
-                phantom_byte_index += 1
-                if phantom_byte_index < 4:
-                    dataToWrite.append("    0x%0.2X" % value)
-                    byteDataFinished = True
-                else:
-                    phantom_byte_index = 0
-                    if value > 0:
-                        # not a phantom byte, so an error occurred
-                        sys.exit("Error aligning the bytes")
-            except:
-                phantom_byte_index += 1
-                if phantom_byte_index < 4:
-                    dataToWrite.append("    0xFF")
-                    byteDataFinished = True
-                else:
-                    phantom_byte_index = 0
-
-
-        dataToWrite.append("\n};\n\n")
-        f.writelines(dataToWrite)
-        dataToWrite.clear()
-
-    # else:
-    #     print("page number: %d is blank" % (page_addr/bytesPerPage))
-
-# Group byte arrays in page structure
-f.write("const hexToC_t hexToC[] =\n{\n")
-pageDataFinished = False
-for i in range(0, len(pageAddressMSW)):
-    if pageDataFinished:
-        f.write(",\n")
-        pageDataFinished = False
-
-    f.write("    {\n")
-    f.write("        " + str("%d" % pageNumber[i]) + ",\n")
-    f.write("        fData" + str(i) + "\n")
-    f.write("    }")
-    pageDataFinished = True
-f.write("\n};\n\n")
-f.write("uint16_t hexToCLength = sizeof(hexToC)/sizeof(hexToC_t);\n")
-
-f.close()
+# array item for every byte value
+byte_items = ["    0x%0.2X" % value for value in range(256)]
+
+
+def non_empty_pages(image, first_address, last_address, page_size):
+    """
+    Returns the start addresses of the pages which contain data, taken straight from the
+    segments of the image. Pages are counted from first_address and only the ones starting
+    below last_address are considered.
+    """
+    page_count = (last_address - first_address + page_size - 1) // page_size
+    pages = []
+
+    for segment in image.segments:
+        if segment.end <= first_address:
+            continue
+        first_page = max(segment.start - first_address, 0) // page_size
+        last_page = min((segment.end - 1 - first_address) // page_size, page_count - 1)
+        for page in range(first_page, last_page + 1):
+            if not pages or pages[-1] < page:
+                pages.append(page)
+
+    return [first_address + page * page_size for page in pages]
+
+
+def page_bytes(image, page_addr, page_size):
+    """
+    Returns the bytes of the page with the phantom bytes (every fourth) left out.
+    Blank bytes are 0xFF. Raises AddressError if a phantom byte is not zero.
+    """
+    phantom_bytes = image.get_range(page_addr, page_size, fill=0)[3::4].tobytes()
+    if phantom_bytes.strip(b'\x00'):
+        # not a phantom byte, so an error occurred
+        raise AddressError("Error aligning the bytes in page at 0x%0.8X" % page_addr)
+
+    data = bytearray(image.get_range(page_addr, page_size, fill=0xFF))
+    del data[3::4]
+    return data
+
+
+def write_c_arrays(image, out_file_name, page_size=bytesPerPage, last_address=None):
+    """
+    Writes every page of the image which contains data to a c file as a byte array,
+    followed by the hexToC table which groups the arrays with their page numbers.
+    :return: list of the page numbers written
+    """
+    first_address = image.get_start_addr()
+    if last_address is None:
+        last_address = image.get_end_addr()
+
+    # the text is put together first, so a page which cannot be converted leaves no partial file
+    page_numbers = []
+    chunks = ["#include \"hex_to_c.h\"\n\n"]
+
+    # write program flash data (byte arrays)
+    for page_addr in non_empty_pages(image, first_address, last_address, page_size):
+        data = page_bytes(image, page_addr, page_size)
+        body = ",\n".join(map(byte_items.__getitem__, data))
+        if page_size % 4 == 0:
+            # the phantom byte closing the page leaves a trailing separator
+            body += ",\n"
+        chunks.append("const uint8_t fData%d[] =\n{\n%s\n};\n\n" % (len(page_numbers), body))
+        page_numbers.append(page_addr // page_size)
+
+    # Group byte arrays in page structure
+    chunks.append("const hexToC_t hexToC[] =\n{\n")
+    chunks.append(",\n".join("    {\n        %d,\n        fData%d\n    }" % (page_number, i)
+                              for i, page_number in enumerate(page_numbers)))
+    chunks.append("\n};\n\n")
+    chunks.append("uint16_t hexToCLength = sizeof(hexToC)/sizeof(hexToC_t);\n")
+
+    with open(out_file_name, 'w') as f:
+        f.write("".join(chunks))
+    return page_numbers
+
+
+def main(argv):
+    # --stats shows where the time went, --stats-memory also the peak memory of every phase
+    stats = None
+    if '--stats' in argv or '--stats-memory' in argv:
+        stats = HexStats(trace_memory='--stats-memory' in argv)
+    argv = [arg for arg in argv if arg not in ('--stats', '--stats-memory')]
+
+    if len(argv) < 2:
+        sys.exit('Usage: %s  <input_file_name.hex> [<output_file_name.c>] [--stats | --stats-memory]' % argv[0])
+
+    if not os.path.exists(argv[1]):
+        sys.exit('ERROR: %s was not found!' % argv[1])
+
+    in_filename = argv[1]
+
+    out_fileName = outputFileName
+    if len(argv) > 2:
+        out_fileName = argv[2]
+
+    lines = HexParser(in_filename, page_size=bytesPerPage, stats=stats)
+    firstAddress = lines.get_start_addr()
+    lastAddress = lines.get_end_addr()
+
+    print("first address: 0x%0.6X" % firstAddress)
+    print("last address detected: 0x%0.6X" % lastAddress)
+
+    if lastAddress > max_valid_address:
+        lastAddress = max_valid_address
+        print("last address considered: 0x%0.6X" % lastAddress)
+
+    print("\nWriting " + out_fileName)
+    try:
+        with stats.phase('c_arrays') if stats is not None else nullcontext():
+            page_numbers = write_c_arrays(lines, out_fileName, bytesPerPage, lastAddress)
+    except AddressError as e:
+        sys.exit(e.value)
+
+    for page_number in page_numbers:
+        print("writing page: %d" % page_number)
+
+    if stats is not None:
+        print(stats.format())
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+'''
+Compares the speed of the table driven CRC32 with the bit by bit crc32() crcCalculation.py used.
+The bit for bit check of the two is test_crcEngine.py.
+Usage: bench_crc.py [<buffer size in bytes>]
+'''
+
+import random
+import sys
+import time
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from crcEngine import crc32
+from test_crcEngine import bitwise
+
+polynom = 0xEB31D82E
+
+
+def main(argv):
+    size = int(argv[1], 0) if len(argv) > 1 else 128 * 1024
+    buffer = random.Random(0).randbytes(size)
+
+    start = time.perf_counter()
+    bitwise(buffer)
+    t_bitwise = time.perf_counter() - start
+
+    start = time.perf_counter()
+    crc32(buffer, polynom)
+    t_table = time.perf_counter() - start
+
+    start = time.perf_counter()
+    crc32(buffer)
+    t_zlib = time.perf_counter() - start
+
+    print("%d bytes   bitwise: %8.1f ms   table: %6.1f ms (%.0fx)   zlib polynomial: %.2f ms"
+          % (size, t_bitwise * 1000, t_table * 1000, t_bitwise / t_table, t_zlib * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+'''
+Compares get_byte/set32 on the segment index with the linear memData scan
+the parser used before the segment store.
+Usage: bench_lookup.py [<image size in bytes>]
+'''
+
+import os
+import sys
+import tempfile
+import timeit
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from intelHexParser import HexParser
+from synthHex import write_hex
+
+
+class LinearLookup:
+    """
+    The previous lookup: one object per byte and a scan over all of them per access.
+    """
+    class ByteData:
+        def __init__(self, address, value):
+            self.address = address
+            self.value = value
+
+    def __init__(self, parser):
+        self.memData = []
+        for segment in parser.segments:
+            for i, value in enumerate(segment.data):
+                self.memData.append(self.ByteData(segment.start + i, value))
+
+    def get_byte(self, address):
+        for oneByte in self.memData:
+            if oneByte.address == address:
+                return oneByte.value
+
+    def set32(self, address, value):
+        for i in range(4):
+            for oneByte in self.memData:
+                if oneByte.address == address + 3 - i:
+                    oneByte.value = (value >> (i * 8)) & 0xFF
+                    break
+
+
+size = int(sys.argv[1], 0) if len(sys.argv) > 1 else 64 * 1024
+fd, hex_name = tempfile.mkstemp(suffix='.hex')
+os.close(fd)
+write_hex(hex_name, size)
+
+parser = HexParser(hex_name, page_size=1024)
+linear = LinearLookup(parser)
+addresses = [parser.get_start_addr() + (i * 7919) % (size - 4) for i in range(200)]
+
+t_linear = timeit.timeit(lambda: [linear.get_byte(a) for a in addresses], number=1)
+t_index = timeit.timeit(lambda: [parser.get_byte(a) for a in addresses], number=1)
+print("get_byte x%d   linear: %8.2f ms   indexed: %8.3f ms   speedup: %.0fx"
+      % (len(addresses), t_linear * 1000, t_index * 1000, t_linear / t_index))
+
+t_linear = timeit.timeit(lambda: [linear.set32(a, 0x12345678) for a in addresses], number=1)
+t_index = timeit.timeit(lambda: [parser.set32(a, 0x12345678) for a in addresses], number=1)
+print("set32 x%d      linear: %8.2f ms   indexed: %8.3f ms   speedup: %.0fx"
+      % (len(addresses), t_linear * 1000, t_index * 1000, t_linear / t_index))
+
+os.remove(hex_name)
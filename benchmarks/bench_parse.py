@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+'''
+Compares HexParser parsing with the per-byte int() parse loop the parser used
+before the shared record decoder.
+Usage: bench_parse.py [<image size in bytes>]
+'''
+
+import os
+import sys
+import tempfile
+import time
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from intelHexParser import HexParser
+from synthHex import write_hex
+
+
+class ByteData:
+    def __init__(self, address, value, row, column):
+        self.address = address
+        self.value = value
+        self.row = row
+        self.column = column
+
+
+def per_byte_parse(in_file_name):
+    """
+    The previous parse loop: one int() and one ByteData object per data byte.
+    """
+    f = open(in_file_name, 'r')
+    content = f.read().splitlines()
+    f.close()
+
+    memData = []
+    address_mem = {}
+    current_address_offset = ""
+    for lineNumber in range(0, len(content)):
+        line = content[lineNumber]
+        if line.startswith(':'):
+            line = line[1:len(line)]
+            reclen = int(line[0:2], 16)
+            addr = int(line[2:6], 16)
+            rectype = int(line[6:8], 16)
+            data = line[8: (8 + reclen*2)]
+
+            if rectype == 1:
+                break
+
+            if rectype == 4:
+                addr_offset = data[0: 4]
+                if addr_offset != "0000":
+                    current_address_offset = addr_offset
+
+            for i in range(0, reclen):
+                value = int(data[(i*2): (i*2 + 2)], 16)
+                if rectype == 0:
+                    data_addr = (int(current_address_offset, 16) << 16) + addr + i
+                    memData.append(ByteData(data_addr, value, lineNumber, 9 + i*2))
+                    address_mem["%0.8X" % data_addr] = 1
+    return memData
+
+
+size = int(sys.argv[1], 0) if len(sys.argv) > 1 else 2 * 1024 * 1024
+fd, hex_name = tempfile.mkstemp(suffix='.hex')
+os.close(fd)
+write_hex(hex_name, size)
+print("%d byte image, %d byte hex file" % (size, os.path.getsize(hex_name)))
+
+start = time.perf_counter()
+per_byte_parse(hex_name)
+t_per_byte = time.perf_counter() - start
+
+start = time.perf_counter()
+HexParser(hex_name, page_size=1024)
+t_decoder = time.perf_counter() - start
+
+print("per byte: %8.1f ms   record decoder: %8.1f ms   speedup: %.1fx"
+      % (t_per_byte * 1000, t_decoder * 1000, t_per_byte / t_decoder))
+
+os.remove(hex_name)
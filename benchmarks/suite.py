@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+'''
+Benchmark suite for the parser and the scripts built on it.
+Generates a synthetic hex file, times the parse, byte access, page queries, hex output,
+the firmware descriptor CRC and the c array export, and saves the results as JSON.
+Given a baseline (the JSON of an earlier run) every benchmark is compared against it and
+the suite fails if one got slower by more than the threshold.
+Usage: suite.py [-s <size>] [--sparsity <0..1>] [-r <record length>] [-o results.json]
+                [-b baseline.json] [-t <threshold>]
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from intelHexParser import HexParser
+from crcCalculation import FirmwareDescriptor
+import Create_array
+from synthHex import write_hex
+
+results_version = 1
+# number of addresses used by the access and page query benchmarks
+access_count = 100000
+
+
+def sample_addresses(image, count, seed=0):
+    """
+    Returns <count> random addresses which hold data in the image.
+    """
+    rnd = random.Random(seed)
+    weights = [len(segment) for segment in image.segments]
+    addresses = []
+    for segment in rnd.choices(image.segments, weights, k=count):
+        addresses.append(segment.start + rnd.randrange(len(segment)))
+    return addresses
+
+
+def bench_parse(context):
+    HexParser(context['hex'], context['page_size'])
+
+
+def bench_get_byte(context):
+    get_byte = context['image'].get_byte
+    for address in context['addresses']:
+        get_byte(address)
+
+
+def bench_set_byte(context):
+    set_byte = context['image'].set_byte
+    for address, value in zip(context['addresses'], context['values']):
+        set_byte(address, value)
+
+
+def bench_page_queries(context):
+    image = context['image']
+    for address in context['addresses']:
+        image.get_same_page_min_addr(address)
+        image.get_same_page_max_addr(address)
+        image.get_page_start_address(address)
+    # a fresh page index every round
+    image.invalidate_page_index()
+    list(image.iter_pages())
+
+
+def bench_write_to_hex(context):
+    context['image'].write_to_hex(context['out'] + '.hex')
+
+
+def bench_crc(context):
+    descriptor = FirmwareDescriptor(context['image'])
+    descriptor.calculate_crc32(*descriptor.get_pages())
+
+
+def bench_c_arrays(context):
+    Create_array.write_c_arrays(context['image'], context['out'] + '.c', Create_array.bytesPerPage)
+
+
+benchmarks = [
+    ('parse', bench_parse),
+    ('get_byte', bench_get_byte),
+    ('set_byte', bench_set_byte),
+    ('page_queries', bench_page_queries),
+    ('write_to_hex', bench_write_to_hex),
+    ('crc', bench_crc),
+    ('c_arrays', bench_c_arrays),
+]
+
+
+def run(size, sparsity=0.0, record_length=16, page_size=1024, repeat=3, names=None):
+    """
+    Runs the benchmarks and returns the results dict with the best time of every benchmark in seconds.
+    """
+    fd, hex_name = tempfile.mkstemp(suffix='.hex')
+    os.close(fd)
+    out_name = hex_name + '.out'
+    write_hex(hex_name, size, record_length=record_length, sparsity=sparsity, phantom_bytes=True)
+
+    image = HexParser(hex_name, page_size)
+    addresses = sample_addresses(image, access_count)
+    context = {
+        'hex': hex_name,
+        'out': out_name,
+        'page_size': page_size,
+        'image': image,
+        'addresses': addresses,
+        # the phantom bytes stay zero for the c array export
+        'values': [0 if address % 4 == 3 else address & 0xFF for address in addresses],
+    }
+
+    timings = {}
+    try:
+        for name, function in benchmarks:
+            if names is not None and name not in names:
+                continue
+            best = None
+            for i in range(0, repeat):
+                start = time.perf_counter()
+                function(context)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+    finally:
+        for file_name in (hex_name, out_name + '.hex', out_name + '.c'):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    return {
+        'version': results_version,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'params': {'size': size, 'sparsity': sparsity, 'record_length': record_length,
+                   'page_size': page_size, 'repeat': repeat, 'access_count': access_count},
+        'timings': timings,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns a list of (name, baseline time, time, ratio) for the benchmarks which got
+    slower than the baseline by more than the threshold (0.2 = 20%).
+    """
+    regressions = []
+    for name, elapsed in results['timings'].items():
+        old = baseline['timings'].get(name)
+        if old and elapsed / old > 1 + threshold:
+            regressions.append((name, old, elapsed, elapsed / old))
+    return regressions
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]), description='HexParser benchmark suite.')
+    arg_parser.add_argument('-s', '--size', type=lambda x: int(x, 0), default=2 * 1024 * 1024,
+                            help='image size in bytes (default: 2 MB)')
+    arg_parser.add_argument('--sparsity', type=float, default=0.0, help='fraction of records left out')
+    arg_parser.add_argument('-r', '--record-length', type=int, default=16)
+    arg_parser.add_argument('-p', '--page-size', type=lambda x: int(x, 0), default=1024)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3, help='runs of every benchmark, the best counts')
+    arg_parser.add_argument('-o', '--output', help='save the results to this JSON file')
+    arg_parser.add_argument('-b', '--baseline', help='compare against the results in this JSON file')
+    arg_parser.add_argument('-t', '--threshold', type=float, default=0.2,
+                            help='allowed slow down against the baseline (default: 0.2 = 20%%)')
+    arg_parser.add_argument('benchmarks', nargs='*', help='run only these benchmarks: %s'
+                            % ', '.join(name for name, function in benchmarks))
+    args = arg_parser.parse_args(argv[1:])
+
+    baseline = None
+    if args.baseline is not None:
+        f = open(args.baseline, 'r')
+        baseline = json.load(f)
+        f.close()
+
+    results = run(args.size, args.sparsity, args.record_length, args.page_size, args.repeat,
+                  args.benchmarks or None)
+
+    for name, elapsed in results['timings'].items():
+        line = "%-14s %10.2f ms" % (name, elapsed * 1000)
+        if baseline is not None and baseline['timings'].get(name):
+            line += "   baseline %10.2f ms   %+6.1f%%" % (baseline['timings'][name] * 1000,
+                                                        (elapsed / baseline['timings'][name] - 1) * 100)
+        print(line)
+
+    if args.output is not None:
+        f = open(args.output, 'w')
+        json.dump(results, f, indent=2)
+        f.close()
+
+    if baseline is not None:
+        if baseline['params'] != results['params']:
+            print("WARNING: the baseline was run with different parameters: %s" % baseline['params'])
+        regressions = compare(results, baseline, args.threshold)
+        for name, old, elapsed, ratio in regressions:
+            print("REGRESSION: %s %.2f ms -> %.2f ms (%.2fx)" % (name, old * 1000, elapsed * 1000, ratio))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
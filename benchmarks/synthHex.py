@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+'''
+Generates synthetic Intel hex files for the benchmarks.
+The image starts at the PIC32 program flash by default and is written with
+extended linear address records the way the linker does it.
+'''
+
+import random
+
+
+def make_record(rectype, address, data):
+    raw = bytes([len(data), (address >> 8) & 0xFF, address & 0xFF, rectype]) + bytes(data)
+    return ':' + (raw + bytes([(-sum(raw)) & 0xFF])).hex().upper()
+
+
+def generate_lines(size, base_addr=0x1D000000, record_length=16, seed=0, sparsity=0.0, phantom_bytes=False):
+    """
+    Yields the lines of a hex file covering <size> bytes of random data starting at <base_addr>.
+    sparsity is the fraction of records left out, leaving gaps in the image.
+    With phantom_bytes every fourth byte is zero, like in PIC32 images (needed by Create_array.py).
+    """
+    rnd = random.Random(seed)
+    current_offset = None
+    address = base_addr
+    end_addr = base_addr + size
+
+    while address < end_addr:
+        if (address >> 16) != current_offset:
+            current_offset = address >> 16
+            yield make_record(4, 0, current_offset.to_bytes(2, 'big'))
+
+        length = min(record_length, end_addr - address, 0x10000 - (address & 0xFFFF))
+        if sparsity and rnd.random() < sparsity:
+            address += length
+            continue
+
+        data = rnd.randbytes(length)
+        if phantom_bytes:
+            data = bytes(0 if (address + i) % 4 == 3 else data[i] for i in range(0, length))
+        yield make_record(0, address & 0xFFFF, data)
+        address += length
+
+    yield make_record(1, 0, b'')
+
+
+def write_hex(file_name, size, base_addr=0x1D000000, record_length=16, seed=0, sparsity=0.0, phantom_bytes=False):
+    f = open(file_name, 'w')
+    for line in generate_lines(size, base_addr, record_length, seed, sparsity, phantom_bytes):
+        f.write(line)
+        f.write("\n")
+    f.close()
@@ -1,268 +1,189 @@
 #!/usr/bin/python3
 '''
-An app I developed had a Firmware descriptor page which contained crc of the whole image. 
+An app I developed had a Firmware descriptor page which contained crc of the whole image.
 This script was used to calculate the crc and write it to the right place in the FwDescriptor.
+It can also be imported: FirmwareDescriptor does the same on an image parsed by HexParser.
 '''
 
 ##### configuration #####
-flashMemSize = 128
 appMinAddress = 0x1D006000
 fwDescriptorAddr = 0x1D01FFDC
 polynom = 0xEB31D82E
+flashBaseAddr = 0x1D000000
+pageSize = 0x400
 ##### end of configuration ####
-fwDescriptor_CRC32_addr = fwDescriptorAddr + 0x1E
-fwDescriptor_start_page_addr = fwDescriptorAddr + 0x14
-fwDescriptor_end_page_addr = fwDescriptorAddr + 0x12
 
 import os
+from contextlib import nullcontext
 from os.path import sys
-import ctypes
-
-print("Calculate hex file CRC32 and write it to firmware descriptor CRC32 field:")
-
-if len(sys.argv) < 2:     
-    sys.exit('Usage: %s  input_file_name.hex' % sys.argv[0])
-
-if not os.path.exists(sys.argv[1]):
-    sys.exit('ERROR: %s was not found!' % sys.argv[1])
-
-filename = sys.argv[1]
-
-   
- 
-#global variables 
-minAddr = flashMemSize * 1024
-maxAddr = 0
-content = []
-addrOffsets = []
-memData = {}
-fwDescCRC32_index = 0
-fwDescCRC32_key = ""
-startPage = 0
-endPage = 0
-startAddr = 0
-endAddr = 0
-totalBytes = 0
-
-
-#convert integer to long so we can work with 32 bits
-def to_ulong(i):
-    return ctypes.c_ulong(i).value
-
-#CRC32 calculation function
-def crc32(data, acc):
-    global totalBytes
-    totalBytes += 1
-    acc = to_ulong(~acc)    
-    acc = acc ^ to_ulong(data)
-    for i in range(0, 8):
-        m = -(acc & 1)
-        acc = (acc >> 1) ^ (polynom & m)        
-    return ~acc
- 
-def calculateParity(stringLine):
-    c_byte = 0
-    for i in range(0, len(stringLine), 2):
-        c_byte_str = stringLine[i: i+2]        
-        c_byte += int(c_byte_str, 16)         
-    c_byte = (~c_byte + 1) & 0xFF 
-    return str.lower("%0.2X" % c_byte)
-    
-    
-def getPageNumber(key):
-    dataAddress = int(key, 16)
-    pagenumber = int((dataAddress - 0x1D000000) / 0x400)
-    return pagenumber
-    
-def getPageAddress(pageNum):
-    return ((pageNum * 0x400) + 0x1D000000)   
-
-
-def writeCRC32_toHex():
-        
-    fwDescData1 = content[fwDescCRC32_index]        #CRC32 starts at this line (big endian MSB)
-    fwDescData2 = content[fwDescCRC32_index + 1]    #CRC32 ends at this line (big endian LSB)
-     
-    #form line to write to the hex file 
-    lineToWrite = fwDescData1[1:37] + CRC32_String[6:8] + CRC32_String[4:6]
-    
-    lineToWrite += calculateParity(lineToWrite)
-    #put the content in the right line and add semicolon
-    print("Writing two bytes of CRC32 at line %d" % fwDescCRC32_index)
-    content[fwDescCRC32_index] = ":" + lineToWrite
-    
-    #form line to write to the hex file
-    lineToWrite = fwDescData2[1: 9] + CRC32_String[2:4] + CRC32_String[0:2] + fwDescData2[13: 17]
-    
-    lineToWrite += calculateParity(lineToWrite)
-    #put the content in the right line and add semicolon
-    print("Writing two bytes of CRC32 at line %d" % (fwDescCRC32_index + 1))
-    content[fwDescCRC32_index + 1] = ":" + lineToWrite
- 
-
-def writeStartAndEndPageIndex_toHex():
-    
-    lineData = content[fwDescCRC32_index]       
-    
-    startPageStr = str.upper("%0.4X" % startPage)   
-    endPageStr = str.upper("%0.4X" % endPage)  
-    
-    #form line to write to the hex file 
-    lineToWrite = lineData[1:13] + endPageStr[2:4] + endPageStr[0:2] + startPageStr[2:4] + startPageStr[0:2] + lineData[21:41]    
-
-    lineToWrite += calculateParity(lineToWrite)
-
-    # put the content in the right line and add semicolon
-    print("Writing fw_end_page and fw_start_page fields to line %d" % (fwDescCRC32_index))
-    content[fwDescCRC32_index] = ":" + lineToWrite
-       
-
-# reading the contents of the hex file
-f = open(filename, 'r') 
-content = f.read().splitlines()
-f.close()
-          
-# parsing the hex file content
-for j in range(0, len(content)):       
-    line = content[j]
-    if line.startswith(':'):
-        line = line[1:len(line)]                       
-        reclen = int(line[0:2], 16)             
-        addr = int(line[2:6], 16)
-        rectype = int(line[6:8], 16)
-        data = line[8: (8 + reclen*2)]
-        
-        if rectype == 4 :
-            addrOffset = data[0: 4]
-            
-            if(addrOffset != "0000") and (addrOffset not in addrOffsets):  
-                addrOffsets.append(addrOffset)
-                
-        for i in range(0, reclen):            
-            temp = int(data[(i*2): (i*2 + 2)], 16) 
-                       
-            if rectype == 0:
-                address = addr + i
-                key = str.upper(addrOffset) + str.upper("%0.4X" % address) 
-                memData[key] = temp
-                                    
-                # adjusting the minimum and maximum found address so we do not have to scan all possible addresses
-                if address > maxAddr :
-                    maxAddr = address
-                if address < minAddr :
-                    minAddr = address
-                
-                if key == str.upper("%0.8X" % fwDescriptorAddr):               
-                    print("\nFound FW descriptor address: 0x" + key + " in line: %d " % j)  
-                    
-                if key == str.upper("%0.8X" % fwDescriptor_CRC32_addr):
-                    fwDescCRC32_index = j     
-                    fwDescCRC32_key = key          
-                    print("Found CRC32 field at: 0x" + key + " in line: %d \n" % fwDescCRC32_index)
-
-
-# only continue if firmware descriptor CRC32 field was found
-if fwDescCRC32_index > 0:
-    
-    # The firmware descriptor contains only start and end page,
-    # not start and end address, so we must align maxAddr and minAddr
-    # to page boundary and calculate CRC32 from that
-    maxAddr |= 0x3FF
-
-    # more global variables
-    crc32result = 0
-    allOffsets = []    
-    firmwareStartFound = False
-    numberOfBlankBytes = 0
-    lastDetectedDataAddr = 0
-    
-    # sorting address offsets
-    for oneOffset in addrOffsets:        
-        allOffsets.append(int(oneOffset, 16)) 
-        allOffsets.sort()
-
-    # search for minimum firmware address
-    for addrOffset in allOffsets:         
-        for dataAddr in range(minAddr, maxAddr + 1):
-            key = str.upper("%0.4X" % addrOffset) + str.upper("%0.4X" % dataAddr) 
-            if (int(key, 16) < fwDescriptorAddr) and (int(key, 16) >= appMinAddress):                                                                
-                if (key in memData):                                         
-                    firmwareStartFound = True
-                    startPage = getPageNumber(key);      
-                    startAddr = int(key,16) & 0xFFFFFC00
-                    print("Firmware start found on page " + str("%d" % startPage) + " at: " + key)               
-                    if dataAddr != (dataAddr & 0xFC00):     # if not page aligned
-                        dataAddr = dataAddr & 0xFC00   # align to page boundary
-                        print("Will start CRC32 calculation starting at: 0x" + str.upper("%0.8X" % startAddr))                    
-                        break 
-        if firmwareStartFound :
-            break
-                        
-       
-    # search for maximum firmware address
-    for dataAddr in range(startAddr, fwDescriptorAddr):
-        key = str.upper("%0.8X" % dataAddr) 
-        if (key in memData):  
-            lastDetectedDataAddr = dataAddr 
-            
-    
-    endPage = getPageNumber(str("%0.8X" % lastDetectedDataAddr));  
-    endAddr = getPageAddress(endPage + 1) - 1
-    print("Firmware last data found on page " + str("%d" % endPage) + " at: 0x" + str.upper("%0.8X" % lastDetectedDataAddr )) 
-    print("Firmware last page end address: 0x%0.8X" % endAddr)
-    
-    
-    # write the first and last page address to data
-    memData[str.upper("%0.8X" % fwDescriptor_end_page_addr)] = endPage & 0xFF
-    memData[str.upper("%0.8X" % (fwDescriptor_end_page_addr + 1))] = endPage >> 8
-    memData[str.upper("%0.8X" % fwDescriptor_start_page_addr)] = startPage & 0xFF
-    memData[str.upper("%0.8X" % (fwDescriptor_start_page_addr + 1))] = startPage >> 8
-    
-    writeStartAndEndPageIndex_toHex()    
-
-    # calculate CRC32
-    print("Calculating CRC32 of the firmware pages")
-    for dataAddr in range(startAddr, endAddr +1):
-        # consider all locations except CRC32 field which is 4 bytes,
-        # just in case the firmware spreads on to the last page
-        if (dataAddr < fwDescriptor_CRC32_addr) or (dataAddr > (fwDescriptor_CRC32_addr + 3)):
-            key = str.upper("%0.8X" % dataAddr)
-            if (key in memData):
-                crc32result = crc32(memData[key], crc32result)
-            else:
-                crc32result = crc32(0xFF, crc32result)  #account for blank bytes 
-
-    # if the firmware does not reach the last page, we need to calculate the CRC32 of that page too
-    # since the firmware descriptor is located there and is part of the firmware too
-    
-    if endAddr < fwDescriptorAddr:  
-        print("Calculating CRC32 of the last page containing the FW descriptor")
-        
-        startAddr = getPageAddress(getPageNumber(str("%0.8X" % fwDescriptorAddr)))
-        endAddr = startAddr + 0x400        
-        
-        for dataAddr in range(startAddr,endAddr):
-            # consider all locations except CRC32 field which is 4 bytes
-            if (dataAddr < fwDescriptor_CRC32_addr) or (dataAddr > (fwDescriptor_CRC32_addr + 3)):
-                key = str.upper("%0.8X" % dataAddr)
-                if key in memData:
-                    crc32result = crc32(memData[key], crc32result)
-                else:
-                    crc32result = crc32(0xFF, crc32result)  #account for blank bytes 
-
-    CRC32_String = str.lower("%0.8X" % to_ulong(crc32result))       
-    print("calculated CRC32: 0x" + str.upper("%0.8X" % to_ulong(crc32result)) )
-    print("total number of bytes: %d" % totalBytes)
-    
-    writeCRC32_toHex()
-        
+from intelHexParser import HexParser, AddressError
+from crcEngine import Crc32
+from digestEngine import DigestPipeline, subtract_ranges
+from hexStats import HexStats
+
+
+class FirmwareDescriptor:
+    """
+    Firmware descriptor of an application image. It holds the first and last page of the
+    firmware and the CRC32 of those pages, the page containing the descriptor included.
+    All fields are little endian:
+        descriptor + 0x12   end page (16 bit)
+        descriptor + 0x14   start page (16 bit)
+        descriptor + 0x1E   CRC32 (32 bit), left out of the CRC itself
+    Usage:
+        <object name> = FirmwareDescriptor(<HexParser object>)
+        <object name>.update()
+    """
+    END_PAGE_OFFSET = 0x12
+    START_PAGE_OFFSET = 0x14
+    CRC32_OFFSET = 0x1E
+
+    def __init__(self, image, descriptor_addr=fwDescriptorAddr, app_min_addr=appMinAddress,
+                 polynom=polynom, page_size=pageSize, flash_base_addr=flashBaseAddr):
+        self.image = image
+        self.descriptor_addr = descriptor_addr
+        self.app_min_addr = app_min_addr
+        self.polynom = polynom
+        self.page_size = page_size
+        self.flash_base_addr = flash_base_addr
+        self.crc32_addr = descriptor_addr + self.CRC32_OFFSET
+        # number of bytes the last calculate_crc32 went through
+        self.total_bytes = 0
+
+    @classmethod
+    def locate(cls, image, magic, magic_offset=0, **kwargs):
+        """
+        Finds the descriptor by a magic value instead of a fixed address, for builds where it moves.
+        magic is a byte string (or compiled bytes regex) found at descriptor + magic_offset.
+        The other arguments are the same as for the constructor.
+        """
+        address = image.find(magic, kwargs.get('app_min_addr', appMinAddress))
+        if address < 0:
+            raise AddressError("Firmware descriptor magic was not found")
+        return cls(image, address - magic_offset, **kwargs)
+
+    def get_page_number(self, address):
+        return (address - self.flash_base_addr) // self.page_size
+
+    def get_page_address(self, page_number):
+        return page_number * self.page_size + self.flash_base_addr
+
+    def first_data_addr(self):
+        """
+        :return: Lowest data address from the application minimum address up to the descriptor
+        """
+        for segment in self.image.segments:
+            if segment.end > self.app_min_addr and segment.start < self.descriptor_addr:
+                return max(segment.start, self.app_min_addr)
+
+        raise AddressError("No firmware data found below the FW descriptor 0x%0.8X" % self.descriptor_addr)
+
+    def last_data_addr(self):
+        """
+        :return: Highest data address below the descriptor
+        """
+        first_addr = self.first_data_addr()
+        for segment in reversed(self.image.segments):
+            if segment.start < self.descriptor_addr and segment.end > first_addr:
+                return min(segment.end, self.descriptor_addr) - 1
+
+        raise AddressError("No firmware data found below the FW descriptor 0x%0.8X" % self.descriptor_addr)
+
+    def get_pages(self):
+        """
+        :return: (start page, end page) of the firmware
+        """
+        return self.get_page_number(self.first_data_addr()), self.get_page_number(self.last_data_addr())
+
+    def crc_ranges(self, start_page, end_page):
+        """
+        Returns the (start, end) address ranges (end inclusive) the CRC32 is calculated over:
+        the firmware pages, plus the descriptor page if the firmware does not reach it.
+        The CRC32 field itself is left out.
+        """
+        ranges = [(self.get_page_address(start_page), self.get_page_address(end_page + 1) - 1)]
+
+        if ranges[0][1] < self.descriptor_addr:
+            descriptor_page = self.get_page_address(self.get_page_number(self.descriptor_addr))
+            ranges.append((descriptor_page, descriptor_page + self.page_size - 1))
+
+        return subtract_ranges(ranges, [(self.crc32_addr, self.crc32_addr + 3)])
+
+    def calculate_digests(self, start_page, end_page, digests):
+        """
+        Feeds the bytes the CRC32 is calculated over to every digest of the {name: digest} dict,
+        in one pass (see digestEngine.py), e.g. {'sha256': hashlib.sha256()} for a release manifest.
+        :return: {name: value} of every digest
+        """
+        pipeline = DigestPipeline(self.image)
+        for name, digest in digests.items():
+            pipeline.add(name, digest)
+        values = pipeline.run(self.crc_ranges(start_page, end_page))
+        self.total_bytes = pipeline.total_bytes
+        return values
+
+    def calculate_crc32(self, start_page, end_page):
+        """
+        Calculates the CRC32 of the firmware pages, blank bytes counted as 0xFF.
+        """
+        return self.calculate_digests(start_page, end_page, {'crc32': Crc32(self.polynom)})['crc32']
+
+    def update(self):
+        """
+        Writes the start and end page to the descriptor, then the CRC32 of the firmware.
+        :return: (start page, end page, CRC32)
+        """
+        try:
+            self.image.get32(self.crc32_addr)
+        except AddressError:
+            raise AddressError("FW descriptor CRC32 field not found")
+
+        start_page, end_page = self.get_pages()
+        self.image.set16(self.descriptor_addr + self.END_PAGE_OFFSET, end_page)
+        self.image.set16(self.descriptor_addr + self.START_PAGE_OFFSET, start_page)
+
+        crc = self.calculate_crc32(start_page, end_page)
+        self.image.set16(self.crc32_addr, crc & 0xFFFF)
+        self.image.set16(self.crc32_addr + 2, crc >> 16)
+        return start_page, end_page, crc
+
+
+def main(argv):
+    print("Calculate hex file CRC32 and write it to firmware descriptor CRC32 field:")
+
+    # --stats shows where the time went, --stats-memory also the peak memory of every phase
+    stats = None
+    if '--stats' in argv or '--stats-memory' in argv:
+        stats = HexStats(trace_memory='--stats-memory' in argv)
+    argv = [arg for arg in argv if arg not in ('--stats', '--stats-memory')]
+
+    if len(argv) < 2:
+        sys.exit('Usage: %s  input_file_name.hex [--stats | --stats-memory]' % argv[0])
+
+    if not os.path.exists(argv[1]):
+        sys.exit('ERROR: %s was not found!' % argv[1])
+
+    filename = argv[1]
+    image = HexParser(filename, page_size=pageSize, stats=stats)
+    descriptor = FirmwareDescriptor(image)
+
+    try:
+        with stats.phase('crc') if stats is not None else nullcontext():
+            start_page, end_page, crc = descriptor.update()
+    except AddressError as e:
+        sys.exit(e.value)
+
+    print("Firmware start found on page %d at: 0x%0.8X" % (start_page, descriptor.first_data_addr()))
+    print("Firmware last data found on page %d at: 0x%0.8X" % (end_page, descriptor.last_data_addr()))
+    print("calculated CRC32: 0x%0.8X" % crc)
+    print("total number of bytes: %d" % descriptor.total_bytes)
+
     # write the modified content back to the hex file
-    f = open(filename, 'w')     
-    for i in range(0, len(content)):
-        f.write(content[i])
-        f.write("\n")
-    f.close()
-   
-    
-else:    
-    sys.exit("FW descriptor CRC32 field not found")
\ No newline at end of file
+    image.write_to_hex(filename)
+
+    if stats is not None:
+        print(stats.format())
+
+
+if __name__ == '__main__':
+    main(sys.argv)
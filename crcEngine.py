@@ -0,0 +1,96 @@
+'''
+CRC engines for whole buffers of image data.
+Reflected CRC32 with a configurable polynomial, the same algorithm crcCalculation.py
+used to run one bit at a time. The standard polynomial is handed to zlib, any other one
+is calculated with a precomputed 256 entry table.
+CRC16-CCITT is handed to binascii.
+'''
+
+import binascii
+import zlib
+
+# reversed representation of the polynomial zlib uses
+ZLIB_POLYNOM = 0xEDB88320
+
+_tables = {}
+
+
+def crc32_table(polynom):
+    """
+    Returns the 256 entry lookup table for the polynomial (reversed representation).
+    Tables are calculated once and shared.
+    """
+    table = _tables.get(polynom)
+    if table is None:
+        table = []
+        for i in range(256):
+            acc = i
+            for bit in range(8):
+                acc = (acc >> 1) ^ (polynom if acc & 1 else 0)
+            table.append(acc)
+        _tables[polynom] = table
+    return table
+
+
+class Crc32:
+    """
+    Incremental CRC32 calculation.
+    The value starts at 0 like zlib.crc32, so Crc32(p).update(a).update(b) gives the
+    same value as Crc32(p).update(a + b).
+    Usage:
+        <object name> = Crc32(<polynom>)
+        <object name>.update(<bytes>)
+        <object name>.value
+    """
+    def __init__(self, polynom=ZLIB_POLYNOM, value=0):
+        self.polynom = polynom
+        self.value = value & 0xFFFFFFFF
+        self._table = None if polynom == ZLIB_POLYNOM else crc32_table(polynom)
+
+    def update(self, data):
+        """
+        Adds the bytes to the CRC. Returns the object itself so calls can be chained.
+        """
+        if self._table is None:
+            self.value = zlib.crc32(data, self.value)
+            return self
+
+        table = self._table
+        acc = self.value ^ 0xFFFFFFFF
+        for byte in data:
+            acc = table[(acc ^ byte) & 0xFF] ^ (acc >> 8)
+        self.value = acc ^ 0xFFFFFFFF
+        return self
+
+    def copy(self):
+        return Crc32(self.polynom, self.value)
+
+
+class Crc16:
+    """
+    Incremental CRC16-CCITT (polynomial 0x1021, MSB first, no final xor) calculated by binascii.crc_hqx.
+    The value starts at 0xFFFF (CRC-16/CCITT-FALSE), start it at 0 for CRC-16/XMODEM.
+    Usage:
+        <object name> = Crc16()
+        <object name>.update(<bytes>)
+        <object name>.value
+    """
+    def __init__(self, value=0xFFFF):
+        self.value = value & 0xFFFF
+
+    def update(self, data):
+        """
+        Adds the bytes to the CRC. Returns the object itself so calls can be chained.
+        """
+        self.value = binascii.crc_hqx(data, self.value)
+        return self
+
+    def copy(self):
+        return Crc16(self.value)
+
+
+def crc32(data, polynom=ZLIB_POLYNOM, value=0):
+    """
+    Returns the CRC32 of the bytes, continuing from value.
+    """
+    return Crc32(polynom, value).update(data).value
@@ -0,0 +1,90 @@
+'''
+Calculates several digests of image ranges in one pass.
+The ranges are read from the image in chunks, with the addresses which were not found filled in,
+and every chunk is handed to all the digests while it is still in the cache, so the image is
+traversed once however many digests are asked for. Sub-ranges can be left out, like the CRC32
+field of the firmware descriptor. Ranges are (start, end) with both ends inclusive, like the
+ranges of HexParser.
+Any object with an update(bytes) method works as a digest: Crc32 and Crc16 from crcEngine.py
+or the hashlib ones.
+Usage:
+    pipeline = DigestPipeline(<HexParser object>)
+    pipeline.add('crc32', Crc32(<polynom>))
+    pipeline.add('crc16', Crc16())
+    pipeline.add('sha256', hashlib.sha256())
+    values = pipeline.run([(<start>, <end>)], exclude=[(<start>, <end>)])
+'''
+
+# bytes read from the image at a time
+chunk_size = 64 * 1024
+
+
+def subtract_ranges(ranges, exclude):
+    """
+    Returns the (start, end) ranges with the excluded ranges left out, in the order of the
+    ranges given. Like the ranges of HexParser, both ends are inclusive. Empty ranges are dropped.
+    """
+    exclude = sorted(exclude)
+    result = []
+    for start, end in ranges:
+        for exclude_start, exclude_end in exclude:
+            if exclude_end < start or exclude_start > end:
+                continue
+            if start < exclude_start:
+                result.append((start, exclude_start - 1))
+            start = max(start, exclude_end + 1)
+            if start > end:
+                break
+        if start <= end:
+            result.append((start, end))
+    return result
+
+
+def digest_value(digest):
+    """
+    Returns the value of a digest: the number of a CRC, the hex digest of a hashlib object.
+    """
+    if hasattr(digest, 'value'):
+        return digest.value
+    return digest.hexdigest()
+
+
+class DigestPipeline:
+    """
+    Digests fed from the same pass over image ranges.
+    The image can be a HexParser or anything else with get_range, e.g. an ImageOverlay.
+    """
+    def __init__(self, image, fill=0xFF, chunk_size=chunk_size):
+        self.image = image
+        self.fill = fill
+        self.chunk_size = chunk_size
+        self.digests = {}
+        # number of bytes the last run went through
+        self.total_bytes = 0
+
+    def add(self, name, digest):
+        """
+        Registers a digest under a name. Returns the digest.
+        """
+        self.digests[name] = digest
+        return digest
+
+    def run(self, ranges, exclude=()):
+        """
+        Feeds the bytes of the (start, end) ranges (end inclusive), without the excluded ranges,
+        to every digest in one pass. Addresses which were not found count as the fill value.
+        :return: {name: value} of every digest, see digest_value
+        """
+        digests = list(self.digests.values())
+        self.total_bytes = 0
+        for start, end in subtract_ranges(ranges, exclude):
+            for address in range(start, end + 1, self.chunk_size):
+                data = self.image.get_range(address, min(self.chunk_size, end + 1 - address), self.fill)
+                for digest in digests:
+                    digest.update(data)
+            self.total_bytes += end + 1 - start
+
+        return self.values()
+
+    def values(self):
+        return {name: digest_value(digest) for name, digest in self.digests.items()}
@@ -0,0 +1,173 @@
+'''
+On disk cache of parsed hex images.
+A snapshot holds the segments, the row map and the metadata of a parsed image in a compact
+binary form. It is keyed by the hash and modification time of the hex file, so an unchanged
+file is loaded by memory mapping its snapshot instead of decoding the hex text again.
+Usage:
+    cache = HexCache(<cache directory>)
+    lines = HexParser(<input hex file name>, <page size>, cache=cache)
+'''
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from intelHexParser import MappedContent, Segment
+
+snapshot_magic = b'IHXS'
+snapshot_version = 1
+# magic, version, length of the json header
+header_format = '<4sII'
+
+
+class HexCache:
+    """
+    Directory of image snapshots, bounded to max_entries snapshots and max_bytes bytes.
+    The least recently used snapshots are evicted first.
+    """
+    def __init__(self, cache_dir, max_entries=64, max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, in_file_name):
+        """
+        Returns the cache key of a hex file: a hash of its content and modification time.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        f = open(in_file_name, 'rb')
+        stat = os.fstat(f.fileno())
+        if stat.st_size > 0:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            digest.update(content)
+            content.close()
+        f.close()
+        digest.update(b'%d' % stat.st_mtime_ns)
+        return digest.hexdigest()
+
+    def _snapshot_name(self, key):
+        return os.path.join(self.cache_dir, key + '.snap')
+
+    def load(self, parser, mapped=False):
+        """
+        Fills a parser from the snapshot of its hex file.
+        Returns False if there is no snapshot for the file in its current state.
+        """
+        snapshot_name = self._snapshot_name(self.key(parser.inFileName))
+        try:
+            f = open(snapshot_name, 'rb')
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+
+        snapshot = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+        try:
+            magic, version, header_length = struct.unpack_from(header_format, snapshot, 0)
+            if magic != snapshot_magic or version != snapshot_version:
+                self.misses += 1
+                return False
+
+            pos = struct.calcsize(header_format)
+            header = json.loads(bytes(snapshot[pos: pos + header_length]))
+            pos += header_length
+            swap = header['byteorder'] != sys.byteorder
+
+            def read_array(typecode, count):
+                nonlocal pos
+                values = array(typecode)
+                values.frombytes(snapshot[pos: pos + count * values.itemsize])
+                if swap:
+                    values.byteswap()
+                pos += count * values.itemsize
+                return values
+
+            line_starts = read_array('Q', header['lines'])
+            segments = []
+            for start, length, records in header['segments']:
+                segment = Segment(start)
+                segment.data = bytearray(snapshot[pos: pos + length])
+                pos += length
+                segment.record_offsets = read_array('I', records)
+                segment.record_rows = read_array('I', records)
+                segments.append(segment)
+        finally:
+            snapshot.close()
+
+        if mapped:
+            parser.content = MappedContent(parser.inFileName, line_starts)
+        else:
+            f = open(parser.inFileName, 'r')
+            parser.content = f.read().splitlines()
+            f.close()
+
+        parser.set_segments(segments)
+        parser.start_linear_addr = header['start_linear_addr']
+        parser.start_segment_addr = header['start_segment_addr']
+
+        # mark the snapshot as recently used
+        os.utime(snapshot_name)
+        self.hits += 1
+        return True
+
+    def store(self, parser):
+        """
+        Writes the snapshot of a freshly parsed image and evicts the least recently used snapshots.
+        """
+        if isinstance(parser.content, MappedContent):
+            line_starts = parser.content.line_starts
+        else:
+            line_starts = MappedContent(parser.inFileName).line_starts
+
+        header = {
+            'byteorder': sys.byteorder,
+            'lines': len(line_starts),
+            'start_linear_addr': parser.start_linear_addr,
+            'start_segment_addr': parser.start_segment_addr,
+            'segments': [[seg.start, len(seg), len(seg.record_offsets)] for seg in parser.segments],
+        }
+        header_bytes = json.dumps(header).encode('ascii')
+
+        snapshot_name = self._snapshot_name(self.key(parser.inFileName))
+        temp_name = snapshot_name + '.%d.tmp' % os.getpid()
+        f = open(temp_name, 'wb')
+        f.write(struct.pack(header_format, snapshot_magic, snapshot_version, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(line_starts.tobytes())
+        for segment in parser.segments:
+            f.write(segment.data)
+            f.write(segment.record_offsets.tobytes())
+            f.write(segment.record_rows.tobytes())
+        f.close()
+        os.replace(temp_name, snapshot_name)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used snapshots until the cache is within its bounds.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.snap'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        entries.sort()
+
+        total_bytes = sum(size for mtime, size, name in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            mtime, size, name = entries.pop(0)
+            os.remove(os.path.join(self.cache_dir, name))
+            total_bytes -= size
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.snap'):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,108 @@
+'''
+Vectorized analysis of parsed hex images, built on HexParser.as_numpy.
+numpy is an optional dependency: it is imported when one of these functions is called,
+so the parser and the scripts work without it.
+Usage:
+    pages = blank_pages(<HexParser object>)
+    errors = phantom_errors(<HexParser object>)
+    counts = histogram(<HexParser object>)
+'''
+
+from intelHexParser import AddressError
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("hexNumpy needs numpy, install it with: pip install numpy")
+    return numpy
+
+
+def page_arrays(image, page_size=None, start=None, end=None, fill=0xFF):
+    """
+    Returns (first page address, data, populated) where data and populated are the arrays
+    of image.as_numpy from the page holding start up to the end of the page holding end,
+    shaped (number of pages, page size).
+    """
+    _numpy()
+    if page_size is None:
+        page_size = image.page_size
+    if start is None:
+        start = image.get_start_addr()
+    if end is None:
+        end = image.get_end_addr()
+
+    first_page = start - start % page_size
+    last_page = end - end % page_size
+    data, populated = image.as_numpy(first_page, last_page + page_size - 1, fill)
+    return first_page, data.reshape(-1, page_size), populated.reshape(-1, page_size)
+
+
+def blank_pages(image, page_size=None, start=None, end=None):
+    """
+    Returns the start addresses of the pages between start and end which are blank:
+    every byte is either not found in the image or 0xFF (erased flash).
+    """
+    numpy = _numpy()
+    if page_size is None:
+        page_size = image.page_size
+    first_page, data, populated = page_arrays(image, page_size, start, end, 0xFF)
+    blank = numpy.all(data == 0xFF, axis=1)
+    return [first_page + int(page) * page_size for page in numpy.flatnonzero(blank)]
+
+
+def empty_pages(image, page_size=None, start=None, end=None):
+    """
+    Returns the start addresses of the pages between start and end holding no data at all.
+    """
+    numpy = _numpy()
+    if page_size is None:
+        page_size = image.page_size
+    first_page, data, populated = page_arrays(image, page_size, start, end)
+    empty = ~numpy.any(populated, axis=1)
+    return [first_page + int(page) * page_size for page in numpy.flatnonzero(empty)]
+
+
+def phantom_errors(image, start=None, end=None, page_size=None):
+    """
+    Returns the addresses of the phantom bytes which are found in the image and are not zero.
+    Like Create_array.py, the pages are counted from get_start_addr() and the phantom byte is
+    every fourth byte of a page (page offset % 4 == 3), which need not be address % 4 == 3.
+    Create_array.py refuses to convert pages holding such bytes.
+    """
+    numpy = _numpy()
+    if page_size is None:
+        page_size = image.page_size
+    origin = image.get_start_addr()
+    if start is None:
+        start = origin
+    if end is None:
+        end = image.get_end_addr()
+
+    data, populated = image.as_numpy(start, end, 0)
+    if page_size % 4 == 0:
+        # every page starts in the same phase, the phantom bytes are simply every fourth one
+        candidates = numpy.arange((3 - (start - origin)) % 4, len(data), 4)
+    else:
+        candidates = numpy.flatnonzero((numpy.arange(start, end + 1) - origin) % page_size % 4 == 3)
+    errors = candidates[(data[candidates] != 0) & populated[candidates]]
+    return [start + int(i) for i in errors]
+
+
+def check_phantom_bytes(image, start=None, end=None, page_size=None):
+    """
+    Raises AddressError for the first phantom byte which is not zero, like Create_array.py does.
+    """
+    errors = phantom_errors(image, start, end, page_size)
+    if errors:
+        raise AddressError("Phantom byte at 0x%0.8X is not zero" % errors[0])
+
+
+def histogram(image, start=None, end=None):
+    """
+    Returns an array with the number of found bytes of every value (256 counters).
+    """
+    numpy = _numpy()
+    data, populated = image.as_numpy(start, end)
+    return numpy.bincount(data[populated], minlength=256)
@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+'''
+Local service which keeps base hex images hot in memory and runs patch/CRC jobs on them,
+so build agents do not start Python and parse the image for every job.
+Requests and responses are JSON objects, one per line, over a Unix socket or localhost TCP.
+Every request carries an "id" which is repeated in its responses, and requests sent on one
+connection are processed concurrently.
+
+    {"id": 1, "op": "job", "file": "app.hex", "page_size": 1024,
+     "patches": [{"addr": 488701916, "size": 4, "value": 305419896},
+                 {"addr": 488701920, "data": "0a0b0c"}],
+     "descriptor": true, "output": "hex"}
+
+A job patches an overlay of the base image (sizes 1, 2 and 4 use set_byte/set16/set32),
+optionally updates the firmware descriptor, and streams the resulting hex lines back in
+{"id": 1, "lines": [...]} chunks (or the binary image, "output": "bin", in {"id": 1, "bin": "<hex>"}
+chunks), followed by {"id": 1, "ok": true, "crc32": ...}.
+Other operations: "load" (parse a base image ahead of time), "stats" and "ping".
+Usage: hexService.py (--unix <socket path> | --port <port>) [--workers <n>] [--threads]
+'''
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from os.path import sys
+
+from intelHexParser import HexParser, AddressError, ChecksumError
+from imageOverlay import ImageOverlay
+from crcCalculation import FirmwareDescriptor
+
+# number of hex lines, or binary bytes, in one streamed response chunk
+chunk_lines = 512
+chunk_bytes = 32 * 1024
+# longest message line the streams accept
+stream_limit = 1024 * 1024
+
+# base images parsed by this (worker) process, by (file name, page size)
+_images = {}
+
+
+def get_image(file_name, page_size):
+    """
+    Returns the parsed base image of the file, parsing it again only if the file changed.
+    """
+    stat = os.stat(file_name)
+    version = (stat.st_mtime_ns, stat.st_size)
+    entry = _images.get((file_name, page_size))
+    if entry is None or entry[0] != version:
+        entry = (version, HexParser(file_name, page_size))
+        _images[(file_name, page_size)] = entry
+    return entry[1]
+
+
+def run_job(request):
+    """
+    Runs one job on an overlay of the base image. Executed in the worker pool.
+    """
+    image = ImageOverlay(get_image(request['file'], request.get('page_size', 1024)))
+    result = {}
+
+    for patch in request.get('patches', []):
+        address = patch['addr']
+        if 'data' in patch:
+            found = image.set_range(address, bytes.fromhex(patch['data']))
+        else:
+            size = patch.get('size', 1)
+            if size not in (1, 2, 4):
+                raise ValueError("patch size must be 1, 2 or 4, not %r" % (size,))
+            setter = {1: image.set_byte, 2: image.set16, 4: image.set32}[size]
+            found = setter(address, patch['value'])
+        if not found:
+            raise AddressError("Address not found! 0x%0.8X" % address)
+
+    if request.get('descriptor'):
+        result['start_page'], result['end_page'], result['crc32'] = FirmwareDescriptor(image).update()
+
+    output = request.get('output', 'hex')
+    if output == 'hex':
+        result['lines'] = list(image.iter_hex_lines())
+    elif output == 'bin':
+        result['bin'] = image.to_bin()
+    return result
+
+
+def load_image(request):
+    image = get_image(request['file'], request.get('page_size', 1024))
+    return {'start_addr': image.get_start_addr(), 'end_addr': image.get_end_addr()}
+
+
+class HexService:
+    """
+    Asyncio server handing the jobs to a pool of worker processes (or threads).
+    """
+    def __init__(self, workers=None, use_threads=False):
+        if use_threads:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.server = None
+        self.connections = set()
+        self.requests = 0
+        self.errors = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.latencies = collections.deque(maxlen=1000)
+
+    async def start_unix(self, path):
+        self.server = await asyncio.start_unix_server(self._handle_connection, path=path, limit=stream_limit)
+        return self.server
+
+    async def start_tcp(self, port, host='127.0.0.1'):
+        self.server = await asyncio.start_server(self._handle_connection, host=host, port=port,
+                                                 limit=stream_limit)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        for connection in list(self.connections):
+            connection.cancel()
+        if self.connections:
+            await asyncio.wait(self.connections)
+        if self.server is not None:
+            await self.server.wait_closed()
+        self.executor.shutdown()
+
+    def stats(self):
+        """
+        Returns the request counters, the current and maximum queue depth and latencies in ms.
+        """
+        latencies = sorted(self.latencies)
+        stats = {
+            'requests': self.requests,
+            'errors': self.errors,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+        }
+        if latencies:
+            stats['latency_ms'] = {
+                'mean': sum(latencies) / len(latencies) * 1000,
+                'p50': latencies[len(latencies) // 2] * 1000,
+                'p95': latencies[int(len(latencies) * 0.95)] * 1000,
+                'max': latencies[-1] * 1000,
+            }
+        return stats
+
+    async def _handle_connection(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        connection = asyncio.current_task()
+        self.connections.add(connection)
+
+        async def send(message):
+            async with lock:
+                writer.write(json.dumps(message).encode('ascii') + b'\n')
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self._handle_request(line, send))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.wait(tasks)
+        except asyncio.CancelledError:
+            # the service is closing
+            for task in tasks:
+                task.cancel()
+        finally:
+            self.connections.discard(connection)
+            writer.close()
+
+    async def _handle_request(self, line, send):
+        start = time.perf_counter()
+        request_id = None
+        self.requests += 1
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            op = request.get('op', 'job')
+
+            if op == 'ping':
+                await send({'id': request_id, 'ok': True})
+            elif op == 'stats':
+                await send({'id': request_id, 'ok': True, 'stats': self.stats()})
+            elif op in ('job', 'load'):
+                function = run_job if op == 'job' else load_image
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.executor, function, request)
+
+                lines = result.pop('lines', None)
+                if lines is not None:
+                    for i in range(0, len(lines), chunk_lines):
+                        await send({'id': request_id, 'lines': lines[i: i + chunk_lines]})
+                data = result.pop('bin', None)
+                if data is not None:
+                    for i in range(0, len(data), chunk_bytes):
+                        await send({'id': request_id, 'bin': data[i: i + chunk_bytes].hex()})
+                result.update({'id': request_id, 'ok': True})
+                await send(result)
+            else:
+                raise ValueError("unknown operation %s" % op)
+        except (AddressError, ChecksumError) as e:
+            self.errors += 1
+            await send({'id': request_id, 'ok': False, 'error': e.value})
+        except KeyError as e:
+            self.errors += 1
+            await send({'id': request_id, 'ok': False, 'error': "missing field %s" % e})
+        except (ValueError, OSError) as e:
+            self.errors += 1
+            await send({'id': request_id, 'ok': False, 'error': str(e)})
+        except Exception as e:
+            # e.g. a field of the wrong type or a broken worker pool: the client still gets its answer
+            self.errors += 1
+            await send({'id': request_id, 'ok': False, 'error': "%s: %s" % (type(e).__name__, e)})
+        finally:
+            self.queue_depth -= 1
+            self.latencies.append(time.perf_counter() - start)
+
+
+class HexServiceClient:
+    """
+    Client for a local HexService. Responses to requests sent concurrently are matched by id
+    and streamed chunks are collected into "lines" (list of hex lines) or "bin" (bytes).
+    Usage:
+        client = await HexServiceClient.connect_unix(<socket path>)
+        result = await client.request({'op': 'job', 'file': 'app.hex', 'descriptor': True})
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.pending = {}
+        self.receiver = asyncio.ensure_future(self._receive())
+
+    @classmethod
+    async def connect_unix(cls, path):
+        reader, writer = await asyncio.open_unix_connection(path, limit=stream_limit)
+        return cls(reader, writer)
+
+    @classmethod
+    async def connect_tcp(cls, port, host='127.0.0.1'):
+        reader, writer = await asyncio.open_connection(host, port, limit=stream_limit)
+        return cls(reader, writer)
+
+    async def _receive(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                future, chunks = self.pending[message['id']]
+                if 'ok' not in message:
+                    for key in ('lines', 'bin'):
+                        if key in message:
+                            chunks.setdefault(key, []).append(message[key])
+                    continue
+
+                del self.pending[message['id']]
+                if 'lines' in chunks:
+                    message['lines'] = [line for chunk in chunks['lines'] for line in chunk]
+                if 'bin' in chunks:
+                    message['bin'] = bytes.fromhex(''.join(chunks['bin']))
+                future.set_result(message)
+            error = ConnectionError("hexService closed the connection")
+        except Exception as e:
+            error = e
+
+        for future, chunks in self.pending.values():
+            future.set_exception(error)
+        self.pending.clear()
+
+    async def request(self, request):
+        """
+        Sends a request and returns its final response, with streamed hex lines collected in "lines".
+        """
+        self.next_id += 1
+        request = dict(request, id=self.next_id)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[self.next_id] = (future, {})
+        self.writer.write(json.dumps(request).encode('ascii') + b'\n')
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        self.receiver.cancel()
+
+
+async def serve(args):
+    service = HexService(args.workers, args.threads)
+    if args.unix is not None:
+        server = await service.start_unix(args.unix)
+    else:
+        server = await service.start_tcp(args.port)
+    print("hexService listening on %s" % (args.unix or "127.0.0.1:%d" % args.port))
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                         description='Local service for hex patch and CRC jobs.')
+    group = arg_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--unix', help='listen on this Unix socket')
+    group.add_argument('--port', type=int, help='listen on this localhost TCP port')
+    arg_parser.add_argument('--workers', type=int, default=None, help='number of workers (default: number of cores)')
+    arg_parser.add_argument('--threads', action='store_true', help='use worker threads instead of processes')
+    args = arg_parser.parse_args(argv[1:])
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv)
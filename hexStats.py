@@ -0,0 +1,127 @@
+'''
+Opt in instrumentation for HexParser and the scripts built on it.
+Collects the time spent in every phase (read, decode, index, flush, write, ...), counters
+(records, bytes, checksum failures, lookups, cache hits, ...) and, if asked for, the peak
+memory of every phase sampled with tracemalloc.
+Usage:
+    stats = HexStats()
+    lines = HexParser(<input hex file name>, <page size>, stats=stats)
+    with stats.phase('crc'):
+        ...
+    print(stats.format())
+'''
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class HexStats:
+    """
+    Phase timers and counters. Hooks are called as hook(event, name, value) with the events:
+        'phase_start'   value None
+        'phase_end'     value is the time the phase took in seconds
+        'count'         value is the amount the counter was increased by
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        # name: {'calls': n, 'seconds': total time, 'peak_memory': bytes}
+        self.phases = {}
+        self.counters = {}
+        self.hooks = []
+        # running memory peaks of the phases in progress, innermost last
+        self._peaks = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _call_hooks(self, event, name, value):
+        for hook in self.hooks:
+            hook(event, name, value)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+        if self.hooks:
+            self._call_hooks('count', name, amount)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the code run in the with block as the phase <name>. Phases can be nested.
+        """
+        if self.hooks:
+            self._call_hooks('phase_start', name, None)
+        if self.trace_memory:
+            self._sample_peak()
+            self._peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            entry = self.phases.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += elapsed
+
+            if self.trace_memory:
+                self._sample_peak()
+                peak = self._peaks.pop()
+                entry['peak_memory'] = max(entry.get('peak_memory', 0), peak)
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+
+            if self.hooks:
+                self._call_hooks('phase_end', name, elapsed)
+
+    def _sample_peak(self):
+        """
+        Adds the traced memory peak since the last sample to the phases in progress.
+        """
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+
+    def to_dict(self):
+        return {'phases': {name: dict(entry) for name, entry in self.phases.items()},
+                'counters': dict(self.counters)}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def merge(self, stats):
+        """
+        Adds the phases and counters of another HexStats, or of its to_dict(), to this one.
+        """
+        if isinstance(stats, HexStats):
+            stats = stats.to_dict()
+        for name, entry in stats['phases'].items():
+            mine = self.phases.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            mine['calls'] += entry['calls']
+            mine['seconds'] += entry['seconds']
+            if 'peak_memory' in entry:
+                mine['peak_memory'] = max(mine.get('peak_memory', 0), entry['peak_memory'])
+        for name, value in stats['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def format(self):
+        """
+        Returns the stats as a human readable table.
+        """
+        lines = []
+        for name, entry in self.phases.items():
+            line = "%-12s %6d x %10.2f ms" % (name, entry['calls'], entry['seconds'] * 1000)
+            if 'peak_memory' in entry:
+                line += "   peak %8.1f KiB" % (entry['peak_memory'] / 1024)
+            lines.append(line)
+        for name, value in self.counters.items():
+            lines.append("%-12s %d" % (name, value))
+        return "\n".join(lines)
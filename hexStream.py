@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+'''
+Streaming filter for hex files of any size: the records are read from a file object one line
+at a time, patched and written to another one, so memory use does not grow with the input.
+Patches use the same byte order as HexParser (set16 LSB first, set32 MSB first). A patched
+record is re-encoded the way HexParser.flush does it, with its checksum fixed up; all other
+lines pass through untouched. With a record size the data records are also regrouped into
+records of that size (converting e.g. 32 byte records into 16 byte ones).
+Usage: hexStream.py [-i <input.hex>] [-o <output.hex>] [--set-byte <addr>=<value>] [--set16 <addr>=<value>]
+                    [--set32 <addr>=<value>] [--set-range <addr>=<hex bytes>] [-r <record size>]
+Input and output default to stdin and stdout.
+'''
+
+import argparse
+import os
+from bisect import bisect_left
+from os.path import sys
+
+from intelHexParser import ChecksumError, calculate_parity, decode_record, encode_record
+
+# lines written to the output at a time
+write_lines = 1024
+
+
+class HexFilter:
+    """
+    Patches applied to a hex stream as it passes through.
+    Usage:
+        <object name> = HexFilter()
+        <object name>.set32(<address>, <value>)
+        <object name>.run(<input file object>, <output file object>)
+    """
+    def __init__(self, record_size=None):
+        if record_size is not None and not 1 <= record_size <= 255:
+            raise ValueError("record size must be in range(1, 256)")
+        self.record_size = record_size
+        self.patches = {}
+        # addresses of the patches, sorted when the stream starts
+        self._addresses = []
+        # patched addresses which were found in the stream
+        self.applied = set()
+
+    def set_byte(self, address, value):
+        if not 0 <= value <= 0xFF:
+            raise ValueError("byte must be in range(0, 256)")
+        self.patches[address] = value
+
+    def set16(self, address, value):
+        """
+        Same byte order as HexParser.set16.
+        """
+        self.set_range(address, (value & 0xFFFF).to_bytes(2, 'little'))
+
+    def set32(self, address, value):
+        """
+        Same byte order as HexParser.set32.
+        """
+        self.set_range(address, (value & 0xFFFFFFFF).to_bytes(4, 'big'))
+
+    def set_range(self, start, data):
+        for i in range(0, len(data)):
+            self.patches[start + i] = data[i]
+
+    def missing(self):
+        """
+        Returns the sorted addresses of the patches which were not found in the stream.
+        """
+        return sorted(set(self.patches) - self.applied)
+
+    def _patch(self, address, data):
+        """
+        Applies the patches falling into the data of a record at the address.
+        Returns the patched data and the first and last (exclusive) patched offset, or None.
+        """
+        i = bisect_left(self._addresses, address)
+        if i == len(self._addresses) or self._addresses[i] >= address + len(data):
+            return data, None
+
+        data = bytearray(data)
+        first = self._addresses[i] - address
+        while i < len(self._addresses) and self._addresses[i] < address + len(data):
+            patch_address = self._addresses[i]
+            data[patch_address - address] = self.patches[patch_address]
+            self.applied.add(patch_address)
+            i += 1
+        return data, (first, self._addresses[i - 1] - address + 1)
+
+    def filter_lines(self, lines):
+        """
+        Yields the output lines (without line terminators) for the input lines.
+        Raises ChecksumError like HexParser if a record is malformed.
+        """
+        self._addresses = sorted(self.patches)
+        self.applied = set()
+        base_address = 0
+        eof = False
+        # records regrouped to the record size: address and data not written yet,
+        # upper 16 address bits of the last extended address written
+        pending_address = None
+        pending = bytearray()
+        upper = 0
+
+        def flush_pending(final=True):
+            """
+            Writes the pending data as records, keeping back a last partial record unless final.
+            """
+            nonlocal pending_address, pending, upper
+            while pending:
+                length = min(self.record_size, len(pending), 0x10000 - (pending_address & 0xFFFF))
+                if not final and length == len(pending) < self.record_size:
+                    return
+                if pending_address >> 16 != upper:
+                    upper = pending_address >> 16
+                    if upper:
+                        yield encode_record(4, 0, upper.to_bytes(2, 'big'))
+                    else:
+                        # an extended linear address of 0000 is ignored by HexParser
+                        yield encode_record(2, 0, b'\x00\x00')
+                yield encode_record(0, pending_address & 0xFFFF, pending[0: length])
+                del pending[0: length]
+                pending_address += length
+            if final:
+                pending_address = None
+
+        row = 0
+        for line in lines:
+            if eof or not line.startswith(':'):
+                if self.record_size is not None:
+                    yield from flush_pending()
+                yield line
+                row += 1
+                continue
+
+            rectype, addr, data = decode_record(line, row)
+            row += 1
+
+            if rectype == 0:
+                data_addr = base_address + addr
+                data, patched = self._patch(data_addr, data)
+                if self.record_size is not None:
+                    if pending_address is not None and pending_address + len(pending) != data_addr:
+                        yield from flush_pending()
+                    if pending_address is None:
+                        pending_address = data_addr
+                    pending += data
+                    yield from flush_pending(final=False)
+                    continue
+
+                if patched is not None:
+                    # re-encode the patched bytes and the checksum, the way HexParser.flush does
+                    first, last = patched
+                    line = line[1:len(line)]
+                    column = 8 + first * 2
+                    line = line[0:column] + data[first: last].hex() + line[(column + (last - first) * 2):len(line) - 2]
+                    line = ':' + line + calculate_parity(line)
+                yield line
+                continue
+
+            if rectype == 1:
+                eof = True
+            elif rectype == 2:
+                base_address = int.from_bytes(data, 'big') << 4
+            elif rectype == 4:
+                # an offset of 0000 is ignored and the previous offset stays in use
+                if data != b'\x00\x00':
+                    base_address = int.from_bytes(data, 'big') << 16
+
+            if self.record_size is not None:
+                yield from flush_pending()
+                if rectype in (2, 4):
+                    # the addresses are written again with the regrouped records
+                    continue
+            yield line
+
+        if self.record_size is not None:
+            yield from flush_pending()
+
+    def run(self, in_stream, out_stream):
+        """
+        Filters the lines of a text input stream to a text output stream.
+        Returns the number of patched bytes which were found.
+        """
+        buffer = []
+        for line in self.filter_lines(line.rstrip('\r\n') for line in in_stream):
+            buffer.append(line)
+            if len(buffer) >= write_lines:
+                buffer.append('')
+                out_stream.write("\n".join(buffer))
+                buffer = []
+        if buffer:
+            buffer.append('')
+            out_stream.write("\n".join(buffer))
+        return len(self.applied)
+
+
+def parse_patch(text):
+    address, value = text.split('=', 1)
+    return int(address, 0), value
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                         description='Patches and converts a hex file as a stream.')
+    arg_parser.add_argument('-i', '--input', help='input hex file (default: stdin)')
+    arg_parser.add_argument('-o', '--output', help='output hex file (default: stdout)')
+    arg_parser.add_argument('--set-byte', action='append', type=parse_patch, default=[], metavar='ADDR=VALUE')
+    arg_parser.add_argument('--set16', action='append', type=parse_patch, default=[], metavar='ADDR=VALUE')
+    arg_parser.add_argument('--set32', action='append', type=parse_patch, default=[], metavar='ADDR=VALUE')
+    arg_parser.add_argument('--set-range', action='append', type=parse_patch, default=[], metavar='ADDR=HEX')
+    arg_parser.add_argument('-r', '--record-size', type=int, help='regroup the data records to this size')
+    args = arg_parser.parse_args(argv[1:])
+
+    if args.input is not None and not os.path.exists(args.input):
+        sys.exit('ERROR: %s was not found!' % args.input)
+
+    try:
+        hex_filter = HexFilter(args.record_size)
+        for address, value in args.set_byte:
+            hex_filter.set_byte(address, int(value, 0))
+        for address, value in args.set16:
+            hex_filter.set16(address, int(value, 0))
+        for address, value in args.set32:
+            hex_filter.set32(address, int(value, 0))
+        for address, value in args.set_range:
+            hex_filter.set_range(address, bytes.fromhex(value))
+    except ValueError as e:
+        sys.exit('ERROR: %s' % e)
+
+    in_stream = sys.stdin if args.input is None else open(args.input, 'r')
+    out_stream = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        hex_filter.run(in_stream, out_stream)
+    except ChecksumError as e:
+        sys.exit(e.value)
+    finally:
+        if args.input is not None:
+            in_stream.close()
+        if args.output is not None:
+            out_stream.close()
+
+    missing = hex_filter.missing()
+    if missing:
+        sys.stderr.write("ERROR: Address not found! 0x%0.8X (%d patched bytes not found)\n"
+                         % (missing[0], len(missing)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
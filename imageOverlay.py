@@ -0,0 +1,181 @@
+'''
+Copy on write overlay for a parsed hex image.
+Used to make many variants of one base image (serial number, MAC address, CRC)
+without parsing or copying the base for every variant.
+'''
+
+import intelHexParser
+from intelHexParser import calculate_parity
+
+
+class ImageOverlay:
+    """
+    View of a HexParser image which keeps the bytes set through it to itself.
+    The base image is shared and never altered, so any number of overlays can be made
+    from one parsed file, each holding only its own patched bytes.
+    Usage:
+        <object name> = ImageOverlay(<HexParser object>)
+    """
+    def __init__(self, base):
+        self.base = base
+        self.patches = {}
+
+    @property
+    def segments(self):
+        return self.base.segments
+
+    @property
+    def page_size(self):
+        return self.base.page_size
+
+    def get_start_addr(self):
+        return self.base.get_start_addr()
+
+    def get_end_addr(self):
+        return self.base.get_end_addr()
+
+    def get_byte(self, address):
+        """
+        Returns the patched value of the byte if there is one, the base value otherwise.
+        Raises AddressError if the address was not found.
+        """
+        value = self.patches.get(address)
+        if value is None:
+            return self.base.get_byte(address)
+        return value
+
+    def get16(self, address):
+        return (self.get_byte(address + 1) << 8) + self.get_byte(address)
+
+    def get32(self, address):
+        retVal = 0
+        for i in range(0, 4):
+            retVal += self.get_byte(address + i) << (i*8)
+
+        return retVal
+
+    def set_byte(self, address, value):
+        """
+        Patches the byte at the address. Only addresses found in the base image can be set.
+        returns:
+            True if the address was found,
+            False otherwise.
+        """
+        if not 0 <= value <= 0xFF:
+            raise ValueError("byte must be in range(0, 256)")
+        if not self.base.has_address(address):
+            return False
+
+        self.patches[address] = value
+        return True
+
+    def set16(self, address, value):
+        """
+        Same byte order as HexParser.set16.
+        """
+        if not self.set_byte((address + 1), (value >> 8) & 0xFF):
+            return False
+
+        return self.set_byte(address, value & 0xFF)
+
+    def set32(self, address, value):
+        """
+        Same byte order as HexParser.set32.
+        """
+        if self.set_byte(address + 3, value & 0xFF):
+            if self.set_byte((address + 2), (value >> 8) & 0xFF):
+                if self.set_byte((address + 1), (value >> 16) & 0xFF):
+                    return self.set_byte(address, (value >> 24) & 0xFF)
+
+        return False
+
+    def set_range(self, start, data):
+        """
+        Patches consecutive bytes, skipping the addresses which were not found.
+        returns:
+            True if all addresses were found,
+            False otherwise.
+        """
+        found = True
+        for i in range(0, len(data)):
+            found = self.set_byte(start + i, data[i]) and found
+        return found
+
+    def fill(self, start, end, value):
+        return self.set_range(start, bytes([value]) * (end - start + 1))
+
+    def _apply_patches(self, view, start):
+        """
+        Returns the bytes of the view, starting at the address start, with the patches applied.
+        The view itself is returned if no patch falls into it.
+        """
+        end = start + len(view)
+        patched = [address for address in self.patches if start <= address < end]
+        if not patched:
+            return view
+
+        data = bytearray(view)
+        for address in patched:
+            data[address - start] = self.patches[address]
+        return memoryview(data).toreadonly()
+
+    def get_range(self, start, length, fill=0xFF):
+        """
+        Same as HexParser.get_range, with the patches applied.
+        """
+        return self._apply_patches(self.base.get_range(start, length, fill), start)
+
+    def to_bin(self, start=None, end=None, fill=0xFF):
+        """
+        Same as HexParser.to_bin, with the patches applied.
+        """
+        if start is None:
+            start = self.base.get_start_addr()
+        return bytes(self._apply_patches(self.base.to_bin(start, end, fill), start))
+
+    def write_to_bin(self, out_file_name, start=None, end=None, fill=0xFF):
+        f = open(out_file_name, 'wb')
+        f.write(self.to_bin(start, end, fill))
+        f.close()
+
+    def _patched_lines(self):
+        """
+        Returns {row: line} for every line of the base content holding a patched byte.
+        """
+        columns = {}
+        for address, value in self.patches.items():
+            row, column = self.base.locate(address)
+            columns.setdefault(row, []).append((column, value))
+
+        lines = {}
+        for row, changes in columns.items():
+            line = self.base.content[row]
+            for column, value in changes:
+                line = line[0:column] + "%0.2x" % value + line[column + 2:]
+            line = line[0:len(line) - 2]
+            lines[row] = line + calculate_parity(line[1:])
+        return lines
+
+    def iter_hex_lines(self):
+        """
+        Yields the lines of the base hex content with the patched lines swapped in.
+        """
+        self.base.flush()
+        patched = self._patched_lines()
+        deleted_string = intelHexParser.deleted_string
+
+        for row, line in enumerate(self.base.content):
+            if row in patched:
+                yield patched[row]
+            elif line != deleted_string:
+                yield line
+
+    def write_to_hex(self, out_file_name):
+        """
+        Writes the base hex content with the patched lines to a file.
+        """
+        chunks = list(self.iter_hex_lines())
+        chunks.append('')
+        f = open(out_file_name, 'w')
+        f.write("\n".join(chunks))
+        f.close()
@@ -2,13 +2,17 @@
 Created on 17.06.2015.
 @author: Rada Berar
 written for python 3 grammar
-
-TODO: change the mem lest into an oredered dictionary
 """
 
 from builtins import int, str
+from array import array
+from bisect import bisect_right
+import mmap
+import re
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 
 # global defines
 deleted_string = "Deleted"
@@ -22,110 +26,947 @@ class AddressError(Exception):
         return repr(self.value)
 
 
+class ChecksumError(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
 def calculate_parity(string_line):
     """
     Calculates the parity for a line of bytes in an Intel hex file.
     Returns the text representation of the parity value in hex form.
     """
-    c_byte = 0
-    for i in range(0, len(string_line), 2):
-        c_byte_str = string_line[i: i+2]
-        c_byte += int(c_byte_str, 16)         
+    c_byte = sum(bytes.fromhex(string_line))
     c_byte = (~c_byte + 1) & 0xFF 
     return str.lower("%0.2X" % c_byte)
 
 
-class ByteData:
+def decode_records(lines, first_row=0):
     """
-    Stores address, value, row and column of a byte found in an Intel hex file
+    Decodes the records of an Intel hex file, one line at a time.
+    Lines which do not start with ':' (blank or deleted rows) are skipped.
+    Yields (row, record type, address, data) for every record, with the data as bytes.
+    Raises ChecksumError if a record is malformed or its checksum does not match.
     """
-    def __init__(self, address, value, row, column):
-        self.address = address
-        self.value = value
-        self.row = row
-        self.column = column
+    row = first_row
+    for line in lines:
+        if line.startswith(':'):
+            yield (row,) + decode_record(line, row)
+        row += 1
+
+
+def decode_record(line, row=0):
+    """
+    Decodes the line of one record, starting with ':'.
+    Returns (record type, address, data), with the data as bytes.
+    Raises ChecksumError if the record is malformed or its checksum does not match.
+    """
+    try:
+        raw = bytes.fromhex(line[1:])
+    except ValueError:
+        raise ChecksumError("Invalid record in line %d" % row)
+
+    if len(raw) < 5 or len(raw) != raw[0] + 5 or sum(raw) & 0xFF:
+        raise ChecksumError("Checksum error in line %d" % row)
+
+    return raw[3], (raw[1] << 8) + raw[2], raw[4:-1]
+
+
+def encode_record(rectype, address, data):
+    """
+    Returns the line of an Intel hex record, checksum included.
+    """
+    raw = bytes([len(data), (address >> 8) & 0xFF, address & 0xFF, rectype]) + bytes(data)
+    return ':' + raw.hex().upper() + "%0.2X" % (-sum(raw) & 0xFF)
+
+
+def check_record_size(record_size):
+    if not 0 < record_size < 256:
+        raise ValueError("Record size must be between 1 and 255, not %d" % record_size)
+
+
+def decode_chunk(text, first_row, mapped=False):
+    """
+    Decodes a chunk of the lines of a hex file for the parallel parse (see HexParser workers).
+    The chunk does not know the address offset in use where it starts, so the data records before
+    its first offset record are put into segments marked unresolved, starting at their 16 bit
+    address. HexParser adds the offset to them once the chunks before are known.
+    Returns a dict:
+        segments            [(Segment, resolved), ...] in file order
+        base_address        the offset in use at the end of the chunk, None if the chunk set none
+        start_segment_addr  start address records met in the chunk, None if there was none
+        start_linear_addr
+        eof                 True if the chunk holds the end of file record
+        error               message of the ChecksumError met in the chunk, None if there was none
+    """
+    if mapped:
+        # raw bytes of the mapped file, the lines still end with their terminators
+        lines = text.decode('ascii').splitlines()
+    else:
+        lines = text.split('\n')
+
+    chunk = {'segments': [], 'base_address': None, 'start_segment_addr': None,
+             'start_linear_addr': None, 'eof': False, 'error': None}
+    base_address = None
+    segment = None
+    try:
+        for lineNumber, rectype, addr, data in decode_records(lines, first_row):
+            if rectype == 0:
+                if data:
+                    resolved = base_address is not None
+                    data_addr = base_address + addr if resolved else addr
+
+                    if segment is None or segment.end != data_addr or chunk['segments'][-1][1] != resolved:
+                        segment = Segment(data_addr)
+                        chunk['segments'].append((segment, resolved))
+                    segment.append_record(data, lineNumber)
+
+            elif rectype == 1:
+                chunk['eof'] = True
+                break
+
+            elif rectype == 2:
+                base_address = int.from_bytes(data, 'big') << 4
+
+            elif rectype == 3:
+                chunk['start_segment_addr'] = int.from_bytes(data, 'big')
+
+            elif rectype == 4:
+                # an offset of 0000 is ignored and the previous offset stays in use
+                if data != b'\x00\x00':
+                    base_address = int.from_bytes(data, 'big') << 16
+
+            elif rectype == 5:
+                chunk['start_linear_addr'] = int.from_bytes(data, 'big')
+    except ChecksumError as e:
+        chunk['error'] = e.value
+
+    chunk['base_address'] = base_address
+    return chunk
+
+
+class Segment:
+    """
+    Stores a run of consecutive bytes found in an Intel hex file.
+    The values are kept in a single bytearray. Every record that contributed to the run is
+    remembered by its offset within the segment and its row in the hex file content,
+    so a byte can still be traced back to the row and column it came from.
+    """
+    def __init__(self, start):
+        self.start = start
+        self.data = bytearray()
+        self.record_offsets = array('I')
+        self.record_rows = array('I')
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def end(self):
+        """
+        First address after the segment.
+        """
+        return self.start + len(self.data)
+
+    def append_record(self, data, row):
+        self.record_offsets.append(len(self.data))
+        self.record_rows.append(row)
+        self.data += data
+
+    def extend(self, other):
+        """
+        Appends a segment which starts right where this one ends.
+        """
+        shift = len(self.data)
+        self.record_offsets.extend(map(shift.__add__, other.record_offsets))
+        self.record_rows.extend(other.record_rows)
+        self.data += other.data
+
+    def split(self, record):
+        """
+        Returns the segments which are left when the record is removed from this one.
+        """
+        offsets = self.record_offsets
+        first = offsets[record]
+        last = offsets[record + 1] if record + 1 < len(offsets) else len(self.data)
+        pieces = []
+
+        if record > 0:
+            left = Segment(self.start)
+            left.data = self.data[0: first]
+            left.record_offsets = offsets[0: record]
+            left.record_rows = self.record_rows[0: record]
+            pieces.append(left)
+
+        if record + 1 < len(offsets):
+            right = Segment(self.start + last)
+            right.data = self.data[last: len(self.data)]
+            right.record_offsets = array('I', (offset - last for offset in offsets[record + 1:]))
+            right.record_rows = self.record_rows[record + 1:]
+            pieces.append(right)
+
+        return pieces
+
+    def locate(self, offset):
+        """
+        :param offset: offset of a byte within the segment
+        :return: (row, column) of the byte in the hex file content
+        """
+        i = bisect_right(self.record_offsets, offset) - 1
+        return self.record_rows[i], 9 + (offset - self.record_offsets[i]) * 2
+
+
+# files with fewer lines are parsed serially even if workers are given
+parallel_min_lines = 4096
+
+# the line breaks of str.splitlines which can occur in an ascii file
+line_break = re.compile(rb'\r\n?|[\n\x0b\x0c\x1c\x1d\x1e]')
+line_break_chars = b'\r\n\x0b\x0c\x1c\x1d\x1e'
+
+
+class MappedContent:
+    """
+    Holds the lines of a hex file as a memory mapped file instead of a list of strings.
+    Only the position where every line starts is indexed and a line is decoded when it is
+    accessed. Lines which are assigned are kept aside until they are written out, when they
+    are spliced into the file.
+    A line index which is already known (e.g. from a cached snapshot) can be passed as line_starts.
+    """
+    def __init__(self, file_name, line_starts=None):
+        self.file_name = file_name
+        self.patched = {}
+        self._open()
+
+        if line_starts is not None:
+            self._starts = line_starts
+            return
+
+        # index where every line starts, the same lines str.splitlines gives when the file is read as text
+        self._starts = array('Q')
+        size = len(self._map)
+        if all(self._map.find(bytes([char])) < 0 for char in b'\r\x0b\x0c\x1c\x1d\x1e'):
+            # \n line breaks only, found a lot faster than with the regex
+            pos = 0
+            while pos < size:
+                self._starts.append(pos)
+                pos = self._map.find(b'\n', pos)
+                pos = size if pos < 0 else pos + 1
+        elif size:
+            self._starts.append(0)
+            self._starts.extend(match.end() for match in line_break.finditer(self._map))
+            if self._starts[-1] == size:
+                self._starts.pop()
+
+    def _open(self):
+        f = open(self.file_name, 'rb')
+        if os.fstat(f.fileno()).st_size > 0:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = b''
+        f.close()
+
+    @property
+    def line_starts(self):
+        """
+        Where every line starts in the file, the index a cached snapshot keeps.
+        """
+        return self._starts
+
+    def _span(self, row):
+        """
+        Returns the (start, end) of the line in the file, line terminator included.
+        """
+        end = self._starts[row + 1] if row + 1 < len(self._starts) else len(self._map)
+        return self._starts[row], end
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, row):
+        if row in self.patched:
+            return self.patched[row]
+        start, end = self._span(row)
+        return self._map[start: end].rstrip(line_break_chars).decode('ascii')
+
+    def __setitem__(self, row, line):
+        self.patched[row] = line
+
+    def __iter__(self):
+        for row in range(len(self._starts)):
+            yield self[row]
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    def _splice(self):
+        """
+        Writes the patched lines straight into the mapped file.
+        Returns False, without writing anything, if a line was deleted or changed its length.
+        """
+        global deleted_string
+
+        for row, line in self.patched.items():
+            start, end = self._span(row)
+            if line == deleted_string or len(line) != len(self._map[start: end].rstrip(line_break_chars)):
+                return False
+
+        f = open(self.file_name, 'r+b')
+        for row, line in self.patched.items():
+            f.seek(self._starts[row])
+            f.write(line.encode('ascii'))
+        f.close()
+        self.patched.clear()
+        return True
+
+    def _copy(self, out_file_name):
+        """
+        Writes the lines to another file, copying the unpatched lines in bulk and leaving the
+        deleted ones out. Returns where every line starts in the new file.
+        """
+        global deleted_string
+
+        starts = array('Q')
+        shift = 0
+        pos = 0
+        f = open(out_file_name, 'wb')
+        for row in sorted(self.patched):
+            start, end = self._span(row)
+            f.write(self._map[pos: start])
+            for unpatched in range(len(starts), row):
+                starts.append(self._starts[unpatched] + shift)
+            starts.append(start + shift)
+
+            line = self.patched[row]
+            old_length = end - start
+            if line != deleted_string:
+                original = self._map[start: end]
+                encoded = line.encode('ascii') + original[len(original.rstrip(line_break_chars)):]
+                f.write(encoded)
+                shift += len(encoded) - old_length
+            else:
+                shift -= old_length
+            pos = end
+        f.write(self._map[pos: len(self._map)])
+        f.close()
+
+        for unpatched in range(len(starts), len(self._starts)):
+            starts.append(self._starts[unpatched] + shift)
+        return starts
+
+    def write_to(self, out_file_name):
+        """
+        Writes the lines to a file. If it is the mapped file itself and no line changed its
+        length, only the patched lines are rewritten.
+        """
+        global deleted_string
+
+        if not (os.path.exists(out_file_name) and os.path.samefile(out_file_name, self.file_name)):
+            self._copy(out_file_name)
+            return
+
+        if self._splice():
+            return
+
+        temp_file_name = out_file_name + '.tmp'
+        starts = self._copy(temp_file_name)
+        self.close()
+        os.replace(temp_file_name, out_file_name)
+        self._open()
+        # deleted lines keep an empty span, everything else is now in the file
+        self._starts = starts
+        self.patched = {row: line for row, line in self.patched.items() if line == deleted_string}
+
+
+def _diff_runs(a, b, address, block=4096):
+    """
+    Yields the (start, end) address runs (end exclusive) where two equally long buffers differ.
+    Blocks are compared in bulk, only the differing ones are split into smaller blocks, down to single bytes.
+    """
+    for i in range(0, len(a), block):
+        j = min(i + block, len(a))
+        if a[i: j] != b[i: j]:
+            if block > 1:
+                yield from _diff_runs(a[i: j], b[i: j], address + i, block // 64 or 1)
+            else:
+                yield address + i, address + j
 
 
 class HexParser:
     """
-    Parses an Intel hex file and saves the contents in a list of byteData objects.
+    Parses an Intel hex file and saves the contents in a sorted list of Segment objects.
     Also provides methods for fetching and altering data as well as writing to the hex file.   
     Usage: 
-        <object name> = hexParser(<input hex file name>)
+        <object name> = hexParser(<input hex file name>, <page size>[, mapped=True][, cache=<HexCache>]
+                                  [, stats=<HexStats>][, workers=<number of processes>])
+    With mapped=True the hex file is memory mapped instead of being read into a list of lines.
+    With a cache (see hexCache.py) an unchanged file is loaded from its snapshot instead of being parsed.
+    With stats (see hexStats.py) the time of every phase and some counters are collected.
+    With workers the records of a large file are decoded in chunks by a pool of processes.
+    A file whose data records hold the same address twice raises AddressError.
     """
     
-    def __init__(self, in_file_name, page_size):
+    def __init__(self, in_file_name, page_size, mapped=False, cache=None, stats=None, workers=None):
+        self._init_attributes(in_file_name, page_size)
+        self.stats = stats
+
+        if not os.path.exists(in_file_name):
+            sys.exit('ERROR: %s was not found!' % in_file_name)
+
+        if cache is not None:
+            with self._phase('cache_load'):
+                loaded = cache.load(self, mapped)
+            if stats is not None:
+                stats.count('cache_hits' if loaded else 'cache_misses')
+            if loaded:
+                self._count_image()
+                return
+
+        # reading the contents of the hex file
+        with self._phase('read'):
+            if mapped:
+                self.content = MappedContent(self.inFileName)
+            else:
+                f = open(self.inFileName, 'r')
+                self.content = f.read().splitlines()
+                f.close()
+
+        try:
+            if workers is not None and workers > 1 and len(self.content) >= parallel_min_lines:
+                self._parse_parallel(workers)
+            else:
+                self._parse_content()
+        except ChecksumError:
+            if stats is not None:
+                stats.count('checksum_failures')
+            raise
+        self._count_image()
+
+        if cache is not None:
+            with self._phase('cache_store'):
+                cache.store(self)
+
+    def _init_attributes(self, in_file_name, page_size):
         self.inFileName = in_file_name
         self.content = []
-        self.memData = []
-        self.address_mem = {}
+        # record size of the hex content still to be generated from the segments, see from_spans
+        self._pending_record_size = None
+        self.segments = []
+        self._segment_starts = []
+        self._page_index = None
         self.minAddr = 0xFFFFFFFF
         self.maxAddr = 0
         self.page_size = page_size
+        self.stats = None
+        self.start_linear_addr = None
+        self.start_segment_addr = None
+        self._dirty = {}
+        # rows of the content changed since the input file was loaded or last written in place
+        self._changed_rows = set()
 
-        if not os.path.exists(in_file_name):
-            sys.exit('ERROR: %s was not found!' % in_file_name)
+    @property
+    def content(self):
+        """
+        The lines of the hex file. An image built from memory (from_bin, merge) generates them
+        from the segments the first time they are needed.
+        """
+        if self._pending_record_size is not None:
+            self._generate_content()
+        return self._content
 
-        # reading the contents of the hex file
-        f = open(self.inFileName, 'r') 
-        self.content = f.read().splitlines()
-        f.close()
-        
-        current_address_offset = ""
-        # parsing the hex file content
-        for lineNumber in range(0, len(self.content)):
-            line = self.content[lineNumber]
-
-            if line.startswith(':'):
-                line = line[1:len(line)]                       
-                reclen = int(line[0:2], 16)             
-                addr = int(line[2:6], 16)
-                rectype = int(line[6:8], 16)
-                data = line[8: (8 + reclen*2)]
-                
-                if rectype == 1:
+    @content.setter
+    def content(self, content):
+        self._content = content
+        self._pending_record_size = None
+
+    def _generate_content(self):
+        """
+        Encodes the segments into the hex content, remembering the row of every record.
+        """
+        record_size = self._pending_record_size
+        self._pending_record_size = None
+        content = []
+        for line, segment, offset in self._encode_image(record_size):
+            if segment is not None:
+                segment.record_offsets.append(offset)
+                segment.record_rows.append(len(content))
+            content.append(line)
+        self._content = content
+
+    def _phase(self, name):
+        """
+        Returns the timer of a phase if the parser is instrumented (see hexStats), a context doing nothing otherwise.
+        """
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.phase(name)
+
+    def _count_image(self):
+        if self.stats is not None:
+            self.stats.count('lines', len(self.content))
+            self.stats.count('records', sum(len(segment.record_offsets) for segment in self.segments))
+            self.stats.count('bytes', sum(len(segment) for segment in self.segments))
+
+    def _parse_content(self):
+        base_address = 0
+        segment = None
+        with self._phase('decode'):
+            # parsing the hex file content
+            for lineNumber, rectype, addr, data in decode_records(self.content):
+                if rectype == 0:
+                    if data:
+                        data_addr = base_address + addr
+
+                        # records usually follow each other, so keep growing the current segment
+                        if segment is None or segment.end != data_addr:
+                            segment = Segment(data_addr)
+                            self.segments.append(segment)
+                        segment.append_record(data, lineNumber)
+
+                elif rectype == 1:
                     # end of record reached
                     break
-                
-                if rectype == 4:
-                    addr_offset = data[0: 4]
-
-                    if addr_offset != "0000":
-                        current_address_offset = addr_offset
-
-                for i in range(0, reclen):
-                    column = 9 + i*2
-                                
-                    value = int(data[(i*2): (i*2 + 2)], 16) 
-                               
-                    if rectype == 0:
-                        address = addr + i
-                        data_addr = (int(current_address_offset, 16) << 16) + address
-
-                        self.memData.append(ByteData(data_addr, value, lineNumber, column))
-                        self.address_mem["%0.8X" % data_addr] = 1
-
-                        # adjusting the minimum and maximum found address
-                        if data_addr > self.maxAddr:
-                            self.maxAddr = data_addr
-                            # print("%0.8X" % data_addr)
-                        if data_addr < self.minAddr:
-                            self.minAddr = data_addr
-
-    def write_to_hex(self, out_file_name):
+
+                elif rectype == 2:
+                    base_address = int.from_bytes(data, 'big') << 4
+
+                elif rectype == 3:
+                    self.start_segment_addr = int.from_bytes(data, 'big')
+
+                elif rectype == 4:
+                    # an offset of 0000 is ignored and the previous offset stays in use
+                    if data != b'\x00\x00':
+                        base_address = int.from_bytes(data, 'big') << 16
+
+                elif rectype == 5:
+                    self.start_linear_addr = int.from_bytes(data, 'big')
+
+        with self._phase('index'):
+            self._coalesce_segments()
+
+    def _parse_parallel(self, workers):
+        """
+        Parses the content in a pool of <workers> processes, one chunk of lines each (see decode_chunk).
+        The chunks are joined in file order: the unresolved segments of a chunk get the address offset
+        left by the chunks before it, and a segment continuing the previous one is appended to it,
+        so the result is the same as the one of _parse_content.
+        """
+        rows = len(self.content)
+        mapped = isinstance(self.content, MappedContent)
+        bounds = [rows * i // workers for i in range(0, workers + 1)]
+
+        with self._phase('decode'):
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = []
+                for first, last in zip(bounds, bounds[1:]):
+                    if mapped:
+                        end = self.content._starts[last] if last < rows else len(self.content._map)
+                        text = self.content._map[self.content._starts[first]: end]
+                    else:
+                        text = '\n'.join(self.content[first: last])
+                    futures.append(executor.submit(decode_chunk, text, first, mapped))
+
+                base_address = 0
+                for future in futures:
+                    chunk = future.result()
+                    for segment, resolved in chunk['segments']:
+                        if not resolved:
+                            segment.start += base_address
+                        if self.segments and self.segments[-1].end == segment.start:
+                            self.segments[-1].extend(segment)
+                        else:
+                            self.segments.append(segment)
+
+                    if chunk['error'] is not None:
+                        for future in futures:
+                            future.cancel()
+                        raise ChecksumError(chunk['error'])
+                    if chunk['base_address'] is not None:
+                        base_address = chunk['base_address']
+                    if chunk['start_segment_addr'] is not None:
+                        self.start_segment_addr = chunk['start_segment_addr']
+                    if chunk['start_linear_addr'] is not None:
+                        self.start_linear_addr = chunk['start_linear_addr']
+                    if chunk['eof']:
+                        for future in futures:
+                            future.cancel()
+                        break
+
+        with self._phase('index'):
+            self._coalesce_segments()
+
+    @classmethod
+    def from_bin(cls, data, base_addr, page_size, record_size=16):
+        """
+        hexParser constructor for a binary image. The data is copied into the image in bulk;
+        the hex content is only generated from it when it is first needed (write_to_hex, delete_row).
+        usage:
+            <object name> = HexParser.from_bin(<bytes>, <base address>, <page size>)
+        """
+        return cls.from_spans([(base_addr, data)], page_size, record_size)
+
+    @classmethod
+    def from_spans(cls, spans, page_size, record_size=16, start_linear_addr=None, start_segment_addr=None):
+        """
+        hexParser constructor for an image made of sorted, non overlapping (address, data) spans.
+        The hex content is generated from the segments when it is first needed, so changes made
+        before that only touch the segments.
+        usage:
+            <object name> = HexParser.from_spans([(<address>, <bytes>), ...], <page size>)
+        """
+        check_record_size(record_size)
+        parser = cls.__new__(cls)
+        parser._init_attributes(None, page_size)
+        parser.start_linear_addr = start_linear_addr
+        parser.start_segment_addr = start_segment_addr
+
+        for start, data in spans:
+            if parser.segments and start < parser.segments[-1].end:
+                raise AddressError("Spans are not sorted or overlap at 0x%0.8X" % start)
+            if not parser.segments or parser.segments[-1].end != start:
+                parser.segments.append(Segment(start))
+            parser.segments[-1].data += data
+
+        parser._coalesce_segments()
+        parser._pending_record_size = record_size
+        return parser
+
+    @classmethod
+    def merge(cls, *images, on_overlap='error', page_size=None, record_size=16):
+        """
+        hexParser constructor combining the memory images of several parsers,
+        e.g. a bootloader and an application. The hex content is generated from the result.
+        on_overlap decides what happens where images hold data at the same address:
+            'error'  raise AddressError if the data differs
+            'first'  keep the data of the image given first
+            'last'   keep the data of the image given last
+        usage:
+            <object name> = HexParser.merge(<HexParser object>, <HexParser object>[, on_overlap='last'])
+        """
+        if on_overlap not in ('error', 'first', 'last'):
+            raise ValueError("on_overlap must be 'error', 'first' or 'last'")
+
+        spans = sorted((segment.start, index, segment)
+                       for index, image in enumerate(images) for segment in image.segments)
+
+        # union of all segments, checking the overlapping parts on the way
+        union = []
+        active = []
+        for start, index, segment in spans:
+            active = [other for other in active if other.end > start]
+            if on_overlap == 'error':
+                for other in active:
+                    end = min(other.end, segment.end)
+                    if segment.data[0: end - start] != other.data[start - other.start: end - other.start]:
+                        raise AddressError("Images hold different data at 0x%0.8X" % start)
+            active.append(segment)
+
+            if union and start <= union[-1][1]:
+                union[-1][1] = max(union[-1][1], segment.end)
+            else:
+                union.append([start, segment.end])
+
+        buffers = [bytearray(end - start) for start, end in union]
+        union_starts = [start for start, end in union]
+        order = range(len(images) - 1, -1, -1) if on_overlap == 'first' else range(len(images))
+        for index in order:
+            for segment in images[index].segments:
+                i = bisect_right(union_starts, segment.start) - 1
+                offset = segment.start - union_starts[i]
+                buffers[i][offset: offset + len(segment)] = segment.data
+
+        start_addresses = [(image.start_linear_addr, image.start_segment_addr) for image in
+                           (images[i] for i in reversed(order))]
+        start_linear_addr = next((linear for linear, segment in start_addresses if linear is not None), None)
+        start_segment_addr = next((segment for linear, segment in start_addresses if segment is not None), None)
+
+        if page_size is None:
+            page_size = images[0].page_size if images else 1024
+        return cls.from_spans(zip(union_starts, buffers), page_size, record_size,
+                               start_linear_addr, start_segment_addr)
+
+    def diff(self, other):
+        """
+        hexParser method for comparing two images.
+        Segments are compared in bulk and only the blocks which differ are looked at byte by byte.
+        usage:
+            for start, end in <object name>.diff(<HexParser object>):
+        yields:
+            (start, end) address ranges (end inclusive) where the values differ or
+            where only one of the images holds data
+        """
+        points = sorted(set(seg.start for seg in self.segments) | set(seg.end for seg in self.segments) |
+                        set(seg.start for seg in other.segments) | set(seg.end for seg in other.segments))
+        pending = None
+        i = j = 0
+
+        for k in range(0, len(points) - 1):
+            start, end = points[k], points[k + 1]
+            while i < len(self.segments) and self.segments[i].end <= start:
+                i += 1
+            while j < len(other.segments) and other.segments[j].end <= start:
+                j += 1
+            mine = self.segments[i] if i < len(self.segments) and self.segments[i].start <= start else None
+            theirs = other.segments[j] if j < len(other.segments) and other.segments[j].start <= start else None
+
+            if mine is None and theirs is None:
+                continue
+            if mine is None or theirs is None:
+                runs = [(start, end)]
+            else:
+                runs = _diff_runs(memoryview(mine.data)[start - mine.start: end - mine.start],
+                                  memoryview(theirs.data)[start - theirs.start: end - theirs.start], start)
+
+            for run_start, run_end in runs:
+                if pending is not None and pending[1] == run_start:
+                    pending[1] = run_end
+                else:
+                    if pending is not None:
+                        yield pending[0], pending[1] - 1
+                    pending = [run_start, run_end]
+
+        if pending is not None:
+            yield pending[0], pending[1] - 1
+
+    def _encode_image(self, record_size):
+        """
+        Generates the hex records of the memory image.
+        Yields (line, segment, offset in the segment) for data records and (line, None, 0) for the rest.
+        """
+        check_record_size(record_size)
+
+        upper_address = 0
+        for segment in self.segments:
+            offset = 0
+            while offset < len(segment):
+                address = segment.start + offset
+                if (address >> 16) != upper_address:
+                    upper_address = address >> 16
+                    yield encode_record(4, 0, upper_address.to_bytes(2, 'big')), None, 0
+
+                # records do not cross a 64K boundary
+                length = min(record_size, len(segment) - offset, 0x10000 - (address & 0xFFFF))
+                yield encode_record(0, address & 0xFFFF, segment.data[offset: offset + length]), segment, offset
+                offset += length
+
+        if self.start_segment_addr is not None:
+            yield encode_record(3, 0, self.start_segment_addr.to_bytes(4, 'big')), None, 0
+        if self.start_linear_addr is not None:
+            yield encode_record(5, 0, self.start_linear_addr.to_bytes(4, 'big')), None, 0
+        yield encode_record(1, 0, b''), None, 0
+
+    def set_segments(self, segments):
+        """
+        hexParser method for replacing the memory image with segments decoded elsewhere,
+        e.g. loaded from a cached snapshot. Their record rows must match the content.
+        usage:
+            <object name>.set_segments(<list of Segment objects>)
+        """
+        self.segments = list(segments)
+        self._coalesce_segments()
+
+    def _coalesce_segments(self):
+        """
+        Sorts the segments by address, joins the ones that touch and adjusts the
+        minimum and maximum found address.
+        Raises AddressError if two data records hold the same address: every lookup
+        assumes the segments never overlap.
+        """
+        self.segments.sort(key=lambda seg: seg.start)
+        coalesced = []
+        for segment in self.segments:
+            if coalesced and coalesced[-1].end > segment.start:
+                row = coalesced[-1].locate(segment.start - coalesced[-1].start)[0]
+                raise AddressError("Address 0x%0.8X is defined twice, in line %d and line %d"
+                                   % (segment.start, row, segment.record_rows[0]))
+            if coalesced and coalesced[-1].end == segment.start:
+                coalesced[-1].extend(segment)
+            else:
+                coalesced.append(segment)
+        self.segments = coalesced
+        self._segment_starts = [seg.start for seg in coalesced]
+        self._page_index = None
+
+        if coalesced:
+            self.minAddr = coalesced[0].start
+            self.maxAddr = max(seg.end for seg in coalesced) - 1
+        else:
+            self.minAddr = 0xFFFFFFFF
+            self.maxAddr = 0
+
+    def _find_segment(self, address):
+        """
+        Finds the segment holding the address with a binary search over the segment starts.
+        Returns None if the address was not found.
+        """
+        if self.stats is not None:
+            self.stats.count('lookups')
+        i = bisect_right(self._segment_starts, address) - 1
+        if i >= 0 and address < self.segments[i].end:
+            return self.segments[i]
+        return None
+
+    def _overlapping(self, start, end):
+        """
+        Yields (segment, first, last) for every segment holding addresses between start and
+        end (exclusive), where first and last (exclusive) are the overlapping addresses.
+        """
+        i = max(bisect_right(self._segment_starts, start) - 1, 0)
+        while i < len(self.segments) and self.segments[i].start < end:
+            segment = self.segments[i]
+            first = max(start, segment.start)
+            last = min(end, segment.end)
+            if first < last:
+                yield segment, first, last
+            i += 1
+
+    def _mark_dirty(self, segment, first, last):
+        """
+        Marks the lines holding the bytes between the segment offsets first and last (exclusive)
+        as changed. Every changed line is re-encoded only once, by flush.
+        """
+        if self._pending_record_size is not None:
+            # the content is not generated yet and will hold the change
+            return
+        offsets = segment.record_offsets
+        i = bisect_right(offsets, first) - 1
+        while i < len(offsets) and offsets[i] < last:
+            record_end = offsets[i + 1] if i + 1 < len(offsets) else len(segment)
+            a = max(first, offsets[i]) - offsets[i]
+            b = min(last, record_end) - offsets[i]
+            row = segment.record_rows[i]
+
+            # [record start address, first and last (exclusive) changed byte of the record]
+            entry = self._dirty.get(row)
+            if entry is None:
+                self._dirty[row] = [segment.start + offsets[i], a, b]
+            else:
+                entry[1] = min(entry[1], a)
+                entry[2] = max(entry[2], b)
+            i += 1
+
+    def flush(self, in_place=False):
+        """
+        hexParser method for writing the altered bytes back to the hex content.
+        set_byte and the other setters only change the memory image and mark the line as changed;
+        the line text and its checksum are regenerated here, once per line. write_to_hex calls it.
+        With in_place=True the changed lines are also written straight into the input hex file,
+        leaving the rest of the file untouched.
+        usage:
+            <object name>.flush([in_place=True])
+        """
+        global deleted_string
+
+        rows = sorted(self._dirty)
+        with self._phase('flush'):
+            for row in rows:
+                record_addr, first, last = self._dirty[row]
+                if self.content[row] == deleted_string:
+                    continue
+                line = self.content[row][1:len(self.content[row])]
+                column = 8 + first * 2
+
+                modified_line = line[0:column] + self.get_range(record_addr + first, last - first).hex() + line[(column + (last - first) * 2):len(line) - 2]
+                modified_line += calculate_parity(modified_line)
+                self.content[row] = ':' + modified_line
+            self._dirty.clear()
+            self._changed_rows.update(rows)
+        if self.stats is not None:
+            self.stats.count('lines_reencoded', len(rows))
+
+        if not in_place:
+            return
+
+        if isinstance(self.content, MappedContent):
+            self.content.write_to(self.inFileName)
+            self._changed_rows.clear()
+            return
+
+        # every line changed since the last in place write, not only the ones re-encoded just now
+        target = MappedContent(self.inFileName)
+        spliced = False
+        if len(target) == len(self.content):
+            for row in self._changed_rows:
+                target[row] = self.content[row]
+            spliced = target._splice()
+        target.close()
+
+        if not spliced:
+            self.write_to_hex(self.inFileName)
+        self._changed_rows.clear()
+
+    def iter_hex_lines(self, record_size=16):
+        """
+        hexParser method for regenerating the hex file from the memory image.
+        Consecutive data is written in records of record_size bytes (1 to 255) and extended
+        linear address records are only emitted where the upper 16 address bits change.
+        usage:
+            for line in <object name>.iter_hex_lines([<record size>]):
+        """
+        for line, segment, offset in self._encode_image(record_size):
+            yield line
+
+    def write_to_hex(self, out_file_name, record_size=None):
         """
         hexParser method for writing the content to a hex file.
+        If a record size is given, the file is regenerated from the memory image
+        (see iter_hex_lines) instead of writing back the original lines.
         usage:
-            <obj name>.writeToHex(<output hex file name>)
+            <obj name>.writeToHex(<output hex file name>[, <record size>])
         """
         global deleted_string
 
-        f = open(out_file_name, 'w')
-        for line in self.content:
-            if line != deleted_string:
-                f.write(line)
-                f.write("\n")
-        f.close()
+        self.flush()
+        with self._phase('write'):
+            if record_size is None and self._pending_record_size is not None:
+                # the content was not generated yet, the lines are written straight from the segments
+                record_size = self._pending_record_size
+            if record_size is not None:
+                chunks = list(self.iter_hex_lines(record_size))
+                chunks.append('')
+                f = open(out_file_name, 'w')
+                f.write("\n".join(chunks))
+                f.close()
+                return
+
+            if isinstance(self.content, MappedContent):
+                self.content.write_to(out_file_name)
+                return
+
+            f = open(out_file_name, 'w')
+            for line in self.content:
+                if line != deleted_string:
+                    f.write(line)
+                    f.write("\n")
+            f.close()
+
+    def has_address(self, address):
+        """
+        hexParser method for checking if an address was found in the hex file.
+        usage:
+            <object name>.has_address(<address>)
+        returns:
+            True if the address holds data, False otherwise
+        """
+        return self._find_segment(address) is not None
+
+    def locate(self, address):
+        """
+        hexParser method for finding where a byte is written in the hex content.
+        usage:
+            <object name>.locate(<address>)
+        returns:
+            (row, column) of the two hex digits of the byte in the content
+        """
+        segment = self._find_segment(address)
+        if segment is None:
+            raise AddressError("Address not found! 0x%0.8X" % address)
+        if self._pending_record_size is not None:
+            self._generate_content()
+        return segment.locate(address - segment.start)
 
     def get_byte(self, address):
         """
@@ -136,14 +977,35 @@ class HexParser:
             8 bit value if the address was found,
             string "ERROR" otherwise
         """
-        try:
-            temp = self.address_mem["%0.8X" % address]
-        except:
+        segment = self._find_segment(address)
+        if segment is None:
             raise AddressError("Address not found! 0x%0.8X" % address)
-        for oneByte in self.memData:
-            if oneByte.address == address:
-                return oneByte.value        
-                break
+
+        return segment.data[address - segment.start]
+
+    def _get_bytes(self, address, length):
+        """
+        Returns the bytes at the address if all of them lie in one segment, None otherwise.
+        """
+        segment = self._find_segment(address)
+        if segment is not None and address + length <= segment.end:
+            offset = address - segment.start
+            return segment.data[offset: offset + length]
+        return None
+
+    def _set_bytes(self, address, data):
+        """
+        Writes the bytes at the address if all of them lie in one segment.
+        Returns True if they were written, False otherwise.
+        """
+        segment = self._find_segment(address)
+        if segment is None or address + len(data) > segment.end:
+            return False
+
+        offset = address - segment.start
+        segment.data[offset: offset + len(data)] = data
+        self._mark_dirty(segment, offset, offset + len(data))
+        return True
 
     def get16(self, address):
         """
@@ -155,6 +1017,9 @@ class HexParser:
             16 bit value if two consecutive requested addresses were found,
             string "ERROR" otherwise
         """
+        data = self._get_bytes(address, 2)
+        if data is not None:
+            return int.from_bytes(data, 'little')
 
         return (self.get_byte(address + 1) << 8) + self.get_byte(address)
             
@@ -168,6 +1033,10 @@ class HexParser:
             32 bit value if 4 consecutive requested addresses were found,
             string "ERROR" otherwise
         """
+        data = self._get_bytes(address, 4)
+        if data is not None:
+            return int.from_bytes(data, 'little')
+
         retVal = 0
         for i in range(0, 4):
             retVal += self.get_byte(address + i) << (i*8)
@@ -183,22 +1052,15 @@ class HexParser:
             True if the address was found, 
             False otherwise.
         """
-        
-        addr_found_flag = False
-        
-        for oneByte in self.memData:
-            if oneByte.address == address:
-                oneByte.value = value
-                addr_found_flag = True
-                # change content of the hex
-                line = self.content[oneByte.row][1:len(self.content[oneByte.row])]
-                
-                modified_line = line[0:(oneByte.column-1)] + str.lower("%0.2X" % oneByte.value) + line[(oneByte.column + 1):len(line) - 2]
-                modified_line += calculate_parity(modified_line)
-                self.content[oneByte.row] = ':' + modified_line
-                break                
-        
-        return addr_found_flag
+        segment = self._find_segment(address)
+        if segment is None:
+            return False
+
+        offset = address - segment.start
+        segment.data[offset] = value
+        # mark the line in the hex content as changed
+        self._mark_dirty(segment, offset, offset + 1)
+        return True
     
     def set16(self, address, value):
         """
@@ -210,7 +1072,9 @@ class HexParser:
             True if the address was found,
             False otherwise.
         """
-                
+        if self._set_bytes(address, (value & 0xFFFF).to_bytes(2, 'little')):
+            return True
+
         if not self.set_byte((address + 1), (value >> 8) & 0xFF):
             return False
         
@@ -226,6 +1090,8 @@ class HexParser:
             True if the address was found,
             False otherwise.
         """
+        if self._set_bytes(address, (value & 0xFFFFFFFF).to_bytes(4, 'big')):
+            return True
 
         if self.set_byte(address + 3, value & 0xFF):
             if self.set_byte((address + 2), (value >> 8) & 0xFF):
@@ -234,45 +1100,271 @@ class HexParser:
                         
         return False
           
+    def iter_runs(self, start, end):
+        """
+        hexParser method for walking the found addresses of a range.
+        usage:
+            for address, length in <object name>.iter_runs(<start address>, <end address>):
+        yields:
+            (address, length) of every run of consecutive found addresses between start and end (inclusive)
+        """
+        for segment, first, last in self._overlapping(start, end + 1):
+            yield first, last - first
+
+    def get_range(self, start, length, fill=0xFF):
+        """
+        hexParser method for getting <length> bytes starting at the specified address.
+        usage:
+            <object name>.get_range(<address>, <length>[, <fill value>])
+        returns:
+            read only memoryview of the bytes. If all of them were found in one segment
+            the view points straight into it, otherwise the addresses which were not found
+            are padded with the fill value.
+        """
+        segment = self._find_segment(start)
+        if segment is not None and start + length <= segment.end:
+            offset = start - segment.start
+            return memoryview(segment.data)[offset: offset + length].toreadonly()
+
+        buffer = bytearray([fill]) * length
+        for segment, first, last in self._overlapping(start, start + length):
+            buffer[first - start: last - start] = memoryview(segment.data)[first - segment.start: last - segment.start]
+        return memoryview(buffer).toreadonly()
+
+    def set_range(self, start, data):
+        """
+        hexParser method for altering consecutive bytes starting at the specified address.
+        Bytes whose address was not found are skipped. Every affected line of the hex
+        content is re-encoded only once, by flush.
+        usage:
+            <object name>.set_range(<address>, <bytes>)
+        returns:
+            True if all addresses were found,
+            False otherwise.
+        """
+        written = 0
+        for segment, first, last in self._overlapping(start, start + len(data)):
+            offset = first - segment.start
+            segment.data[offset: offset + last - first] = data[first - start: last - start]
+            self._mark_dirty(segment, offset, offset + last - first)
+            written += last - first
+
+        return written == len(data)
+
+    def fill(self, start, end, value):
+        """
+        hexParser method for setting all found addresses from start to end (inclusive)
+        to the same value.
+        usage:
+            <object name>.fill(<start address>, <end address>, <value>)
+        returns:
+            True if all addresses were found,
+            False otherwise.
+        """
+        return self.set_range(start, bytes([value]) * (end - start + 1))
+
+    def to_bin(self, start=None, end=None, fill=0xFF):
+        """
+        hexParser method for getting the image as flat binary data.
+        usage:
+            <object name>.to_bin([<start address>, <end address>, <fill value>])
+        returns:
+            bytes from start to end (inclusive), by default get_start_addr() to get_end_addr(),
+            with the addresses which were not found set to the fill value.
+        """
+        if start is None:
+            start = self.minAddr
+        if end is None:
+            end = self.maxAddr
+        if end < start:
+            return b''
+
+        return self.get_range(start, end - start + 1, fill).tobytes()
+
+    def _search_runs(self, start, end):
+        """
+        Yields (run address, buffer, first, last) for every run of touching segments holding addresses
+        between start and end (inclusive), where first and last (exclusive) bound the searched part of
+        the buffer. A run of one segment is searched in place, longer runs are joined first.
+        """
+        run = []
+        for segment, first, last in self._overlapping(start, end + 1):
+            if run and run[-1][0].end != segment.start:
+                yield self._join_run(run)
+                run = []
+            run.append((segment, first, last))
+        if run:
+            yield self._join_run(run)
+
+    def _join_run(self, run):
+        segment, first, last = run[0]
+        if len(run) == 1:
+            return segment.start, segment.data, first - segment.start, last - segment.start
+        buffer = bytearray().join(segment.data[first - segment.start: last - segment.start]
+                                  for segment, first, last in run)
+        return first, buffer, 0, len(buffer)
+
+    def find_all(self, pattern, start=None, end=None):
+        """
+        hexParser method for searching the image for a byte string or a compiled bytes regex.
+        Matches never span addresses which were not found, but do span touching segments.
+        usage:
+            for address in <object name>.find_all(<bytes or re.compile(rb'...')>[, <start address>, <end address>]):
+        yields:
+            the address of every (non overlapping) match lying between start and end (inclusive)
+        """
+        if not hasattr(pattern, 'finditer') and len(pattern) == 0:
+            raise ValueError("Search pattern must not be empty")
+        if start is None:
+            start = self.minAddr
+        if end is None:
+            end = self.maxAddr
+
+        for run_start, buffer, first, last in self._search_runs(start, end):
+            if hasattr(pattern, 'finditer'):
+                for match in pattern.finditer(buffer, first, last):
+                    # an empty match can sit right behind the last byte
+                    if match.start() >= last:
+                        break
+                    yield run_start + match.start()
+            else:
+                i = buffer.find(pattern, first, last)
+                while i >= 0:
+                    yield run_start + i
+                    i = buffer.find(pattern, i + len(pattern), last)
+
+    def find(self, pattern, start=None, end=None):
+        """
+        hexParser method for finding the first match of a byte string or a compiled bytes regex.
+        usage:
+            <object name>.find(<bytes or re.compile(rb'...')>[, <start address>, <end address>])
+        returns:
+            address of the first match lying between start and end (inclusive), -1 if there is none
+        """
+        return next(self.find_all(pattern, start, end), -1)
+
+    def as_numpy(self, start=None, end=None, fill=0xFF):
+        """
+        hexParser method for getting the image as numpy arrays, built straight from the segments.
+        numpy is only imported here, the rest of the parser does not need it.
+        usage:
+            data, populated = <object name>.as_numpy([<start address>, <end address>, <fill value>])
+        returns:
+            uint8 array of the bytes from start to end (inclusive), by default get_start_addr()
+            to get_end_addr(), with the addresses which were not found set to the fill value,
+            and a bool array which is True where the address was found.
+        """
+        import numpy
+
+        if start is None:
+            start = self.minAddr
+        if end is None:
+            end = self.maxAddr
+        length = max(end - start + 1, 0)
+
+        data = numpy.full(length, fill, dtype=numpy.uint8)
+        populated = numpy.zeros(length, dtype=bool)
+        for segment, first, last in self._overlapping(start, start + length):
+            data[first - start: last - start] = numpy.frombuffer(segment.data, numpy.uint8, last - first,
+                                                                 first - segment.start)
+            populated[first - start: last - start] = True
+        return data, populated
+
+    def write_to_bin(self, out_file_name, start=None, end=None, fill=0xFF):
+        """
+        hexParser method for writing the image to a binary file, see to_bin.
+        usage:
+            <object name>.write_to_bin(<output file name>[, <start address>, <end address>, <fill value>])
+        """
+        with self._phase('write'):
+            f = open(out_file_name, 'wb')
+            f.write(self.to_bin(start, end, fill))
+            f.close()
+
     def get_start_addr(self):
         return self.minAddr
     
     def get_end_addr(self):
         return self.maxAddr
 
+    def _get_page_index(self):
+        """
+        Returns the page index, building it on first use.
+        It maps every page number holding data to [minimum address, maximum address, number of bytes].
+        """
+        if self._page_index is None or self._page_index[0] != self.page_size:
+            index = {}
+            for segment in self.segments:
+                start = segment.start
+                while start < segment.end:
+                    page = start // self.page_size
+                    end = min(segment.end, (page + 1) * self.page_size)
+                    entry = index.get(page)
+                    if entry is None:
+                        index[page] = [start, end - 1, end - start]
+                    else:
+                        entry[0] = min(entry[0], start)
+                        entry[1] = max(entry[1], end - 1)
+                        entry[2] += end - start
+                    start = end
+            self._page_index = (self.page_size, index)
+
+        return self._page_index[1]
+
+    def invalidate_page_index(self):
+        """
+        hexParser method for dropping the page index, it is rebuilt by the next page query.
+        usage:
+            <object name>.invalidate_page_index()
+        """
+        self._page_index = None
+
     def get_same_page_min_addr(self, address):
         """
         :param address:
         :return: Minimum address in the same address segment (Program flash or boot flash)
         """
-        min_address = self.maxAddr
+        entry = self._get_page_index().get(address // self.page_size)
+        if entry is None:
+            return self.maxAddr
 
-        for sample in self.memData:
-            if (sample.address // self.page_size) == (address // self.page_size):
-                if min_address > sample.address:
-                    min_address = sample.address
-
-        return min_address
+        return entry[0]
 
     def get_same_page_max_addr(self, address):
         """
         :param address:
         :return: Maximum address in the same address segment (Program flash or boot flash)
         """
-        max_address = self.minAddr
-
-        for sample in self.memData:
-            # print("0x%0.8X" % sample.address)
-            if (sample.address // self.page_size) == (address // self.page_size):
+        entry = self._get_page_index().get(address // self.page_size)
+        if entry is None:
+            return self.minAddr
 
-                if max_address < sample.address:
-                    max_address = sample.address
+        return entry[1]
 
-        return max_address
+    def iter_pages(self):
+        """
+        hexParser method for going through the pages which hold data, in address order.
+        usage:
+            for page_number, min_addr, max_addr, byte_count in <object name>.iter_pages():
+        """
+        for page, entry in sorted(self._get_page_index().items()):
+            yield page, entry[0], entry[1], entry[2]
 
     def get_page_start_address(self, address):
         return (address // self.page_size) * self.page_size
 
     def delete_row(self, row):
+        """
+        hexParser method for deleting a row of the hex file.
+        If it is a data record its bytes are removed from the memory image too.
+        """
         global deleted_string
         self.content[row] = deleted_string
+        self._changed_rows.add(row)
+
+        for i in range(0, len(self.segments)):
+            segment = self.segments[i]
+            if row in segment.record_rows:
+                self.segments[i: i + 1] = segment.split(segment.record_rows.index(row))
+                self._coalesce_segments()
+                break
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+'''
+Runs a pipeline of operations over many hex files, parsing them in parallel in a pool of processes.
+Operations are applied to every file in the given order:
+    crc      calculate the CRC32 of the firmware described by the firmware descriptor
+    patch    write start page, end page and CRC32 to the firmware descriptor
+    carray   write the image as c arrays to <file name>.c
+    emit     write the image back to the hex file (or to the output directory)
+Usage: intelhex.py [-o crc,patch,emit] [-j <jobs>] [-d <output dir>] [--stats | --stats-memory] <input_file_name.hex> ...
+'''
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from os.path import sys
+
+from intelHexParser import HexParser, AddressError, ChecksumError
+from crcCalculation import FirmwareDescriptor
+from hexStats import HexStats
+import Create_array
+
+
+operations = ('crc', 'patch', 'carray', 'emit')
+
+
+def output_file_name(file_name, out_dir, extension=None):
+    if extension is not None:
+        file_name = os.path.splitext(file_name)[0] + extension
+    if out_dir is not None:
+        file_name = os.path.join(out_dir, os.path.basename(file_name))
+    return file_name
+
+
+def process_file(file_name, ops, page_size=1024, out_dir=None, collect_stats=False, trace_memory=False):
+    """
+    Parses one hex file and runs the operations on it.
+    Returns a report dict with the results and the time every step took, in seconds.
+    With collect_stats the report also holds the HexStats of the file, as a dict,
+    with trace_memory including the peak memory of every phase.
+    """
+    timings = []
+    report = {'file': file_name, 'timings': timings}
+    stats = HexStats(trace_memory) if collect_stats or trace_memory else None
+
+    try:
+        start = time.perf_counter()
+        image = HexParser(file_name, page_size, stats=stats)
+        timings.append(('parse', time.perf_counter() - start))
+
+        for op in ops:
+            start = time.perf_counter()
+            with stats.phase(op) if stats is not None else nullcontext():
+                if op == 'crc':
+                    descriptor = FirmwareDescriptor(image)
+                    report['crc32'] = descriptor.calculate_crc32(*descriptor.get_pages())
+                elif op == 'patch':
+                    report['start_page'], report['end_page'], report['crc32'] = FirmwareDescriptor(image).update()
+                elif op == 'carray':
+                    last_address = min(image.get_end_addr(), Create_array.max_valid_address)
+                    Create_array.write_c_arrays(image, output_file_name(file_name, out_dir, '.c'),
+                                                Create_array.bytesPerPage, last_address)
+                elif op == 'emit':
+                    image.write_to_hex(output_file_name(file_name, out_dir))
+            timings.append((op, time.perf_counter() - start))
+    except (AddressError, ChecksumError) as e:
+        report['error'] = e.value
+    except (OSError, ValueError) as e:
+        # e.g. an output file which cannot be written: the other files still get their reports
+        report['error'] = str(e)
+
+    if stats is not None:
+        report['stats'] = stats.to_dict()
+    return report
+
+
+def format_report(report):
+    text = "%s:" % report['file']
+    for step, elapsed in report['timings']:
+        text += " %s %.1f ms," % (step, elapsed * 1000)
+    text += " total %.1f ms" % (sum(elapsed for step, elapsed in report['timings']) * 1000)
+    if 'crc32' in report:
+        text += ", CRC32 0x%0.8X" % report['crc32']
+    if 'error' in report:
+        text += ", ERROR: %s" % report['error']
+    return text
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                         description='Runs a pipeline of operations over many hex files in parallel.')
+    arg_parser.add_argument('files', nargs='+', help='input hex files')
+    arg_parser.add_argument('-o', '--ops', default='crc',
+                            help='comma separated operations: %s (default: crc)' % ','.join(operations))
+    arg_parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                            help='number of worker processes (default: number of cores)')
+    arg_parser.add_argument('-d', '--out-dir', help='write output files here instead of next to the input')
+    arg_parser.add_argument('-p', '--page-size', type=lambda x: int(x, 0), default=1024)
+    arg_parser.add_argument('--stats', action='store_true', help='show the phase timings and counters of all files')
+    arg_parser.add_argument('--stats-memory', action='store_true',
+                            help='like --stats, also sampling the peak memory of every phase (slower)')
+    args = arg_parser.parse_args(argv[1:])
+
+    ops = [op for op in args.ops.split(',') if op]
+    for op in ops:
+        if op not in operations:
+            sys.exit('ERROR: unknown operation %s' % op)
+
+    for file_name in args.files:
+        if not os.path.exists(file_name):
+            sys.exit('ERROR: %s was not found!' % file_name)
+
+    if args.out_dir is not None:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    failed = 0
+    collect_stats = args.stats or args.stats_memory
+    stats = HexStats() if collect_stats else None
+    jobs = max(1, min(args.jobs or 1, len(args.files)))
+    if jobs == 1:
+        reports = (process_file(f, ops, args.page_size, args.out_dir, collect_stats, args.stats_memory)
+                   for f in args.files)
+        for report in reports:
+            print(format_report(report))
+            failed += 'error' in report
+            if stats is not None:
+                stats.merge(report['stats'])
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(process_file, f, ops, args.page_size, args.out_dir, collect_stats,
+                                       args.stats_memory)
+                       for f in args.files]
+            for future in futures:
+                report = future.result()
+                print(format_report(report))
+                failed += 'error' in report
+                if stats is not None:
+                    stats.merge(report['stats'])
+
+    print("%d files, %d failed, %d jobs, wall time %.1f ms"
+          % (len(args.files), failed, jobs, (time.perf_counter() - start) * 1000))
+    if stats is not None:
+        print(stats.format())
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+'''
+Page granular delta updates between two hex images.
+The old and new image are compared page by page and only the pages which changed are shipped:
+the populated address runs of the new page, optionally compressed with zlib. The manifest holds
+the CRC32 of every changed page in the old and the new image, so the device (or apply_delta)
+can check it is patching the right base and that the result is what was built.
+Usage:
+    otaDelta.py <old.hex> <new.hex> <delta file> [-p <page size>] [--no-compress]
+    otaDelta.py --apply <old.hex> <delta file> <output.hex>
+'''
+
+import argparse
+import json
+import os
+import struct
+import zlib
+from os.path import sys
+
+from intelHexParser import HexParser, AddressError, ChecksumError
+
+delta_magic = b'IHXD'
+delta_version = 1
+# magic, version, length of the json manifest
+header_format = '<4sII'
+
+
+def page_numbers(image, page_size):
+    """
+    Returns the set of page numbers holding data in the image.
+    """
+    pages = set()
+    for segment in image.segments:
+        pages.update(range(segment.start // page_size, (segment.end - 1) // page_size + 1))
+    return pages
+
+
+def page_runs(image, page_addr, page_size):
+    """
+    Returns the populated [address, length] runs of a page.
+    """
+    return [[address, length] for address, length in image.iter_runs(page_addr, page_addr + page_size - 1)]
+
+
+def page_crc(image, page_addr, page_size):
+    """
+    Returns the CRC32 of the page with the empty addresses filled with 0xFF,
+    or None if the page holds no data.
+    """
+    if next(image.iter_runs(page_addr, page_addr + page_size - 1), None) is None:
+        return None
+    return zlib.crc32(image.get_range(page_addr, page_size, 0xFF))
+
+
+class OtaDelta:
+    """
+    The changed pages of an image. Every page entry of the manifest is a dict:
+        page      page number
+        old_crc   CRC32 of the page in the old image (None if it held no data)
+        new_crc   CRC32 of the page in the new image (None if the page was erased)
+        runs      populated [address, length] runs of the new page
+        size      length of the (compressed) payload of the page
+    """
+    def __init__(self, page_size, compressed=True):
+        self.page_size = page_size
+        self.compressed = compressed
+        self.pages = []
+        self.payloads = []
+        self.start_linear_addr = None
+        self.start_segment_addr = None
+
+    def add_page(self, page, old_crc, new_crc, runs, data):
+        if self.compressed:
+            data = zlib.compress(data)
+        self.pages.append({'page': page, 'old_crc': old_crc, 'new_crc': new_crc, 'runs': runs, 'size': len(data)})
+        self.payloads.append(data)
+
+    def page_data(self, i):
+        """
+        Returns the populated bytes of the i-th page of the delta, decompressed.
+        """
+        if self.compressed:
+            return zlib.decompress(self.payloads[i])
+        return self.payloads[i]
+
+    def manifest(self):
+        return {
+            'page_size': self.page_size,
+            'compressed': self.compressed,
+            'start_linear_addr': self.start_linear_addr,
+            'start_segment_addr': self.start_segment_addr,
+            'pages': self.pages,
+        }
+
+    def to_bytes(self):
+        manifest = json.dumps(self.manifest()).encode('ascii')
+        return b''.join([struct.pack(header_format, delta_magic, delta_version, len(manifest)), manifest] +
+                        self.payloads)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, manifest_length = struct.unpack_from(header_format, data, 0)
+        if magic != delta_magic or version != delta_version:
+            raise ValueError("not a version %d delta" % delta_version)
+
+        pos = struct.calcsize(header_format)
+        manifest = json.loads(bytes(data[pos: pos + manifest_length]))
+        pos += manifest_length
+
+        delta = cls(manifest['page_size'], manifest['compressed'])
+        delta.start_linear_addr = manifest['start_linear_addr']
+        delta.start_segment_addr = manifest['start_segment_addr']
+        for entry in manifest['pages']:
+            delta.pages.append(entry)
+            delta.payloads.append(bytes(data[pos: pos + entry['size']]))
+            pos += entry['size']
+        return delta
+
+
+def make_delta(old, new, page_size=None, compress=True):
+    """
+    Compares two HexParser images page by page and returns an OtaDelta with the pages that changed.
+    A page changed if its bytes or its populated addresses differ.
+    """
+    if page_size is None:
+        page_size = new.page_size
+
+    delta = OtaDelta(page_size, compress)
+    delta.start_linear_addr = new.start_linear_addr
+    delta.start_segment_addr = new.start_segment_addr
+
+    for page in sorted(page_numbers(old, page_size) | page_numbers(new, page_size)):
+        page_addr = page * page_size
+        runs = page_runs(new, page_addr, page_size)
+        # the bytes themselves are compared, the CRCs are only for the manifest
+        if (runs == page_runs(old, page_addr, page_size)
+                and old.get_range(page_addr, page_size, 0xFF) == new.get_range(page_addr, page_size, 0xFF)):
+            continue
+
+        data = b''.join(new.get_range(address, length) for address, length in runs)
+        delta.add_page(page, page_crc(old, page_addr, page_size), page_crc(new, page_addr, page_size), runs, data)
+
+    return delta
+
+
+def apply_delta(old, delta, record_size=16):
+    """
+    Rebuilds the new image from the old HexParser image and a delta and returns it as a new HexParser.
+    Raises ChecksumError if a page of the old image is not the one the delta was made from,
+    or if a rebuilt page does not match its CRC.
+    """
+    page_size = delta.page_size
+    changed = {}
+    for i in range(0, len(delta.pages)):
+        entry = delta.pages[i]
+        page_addr = entry['page'] * page_size
+        if page_crc(old, page_addr, page_size) != entry['old_crc']:
+            raise ChecksumError("Page 0x%0.8X of the old image does not match the delta!" % page_addr)
+        changed[entry['page']] = i
+
+    spans = []
+    # the bytes of the old image outside of the changed pages
+    for segment in old.segments:
+        view = memoryview(segment.data)
+        start = segment.start
+        for page in range(segment.start // page_size, (segment.end - 1) // page_size + 1):
+            if page in changed:
+                page_addr = page * page_size
+                if start < page_addr:
+                    spans.append((start, view[start - segment.start: page_addr - segment.start]))
+                start = max(start, page_addr + page_size)
+        if start < segment.end:
+            spans.append((start, view[start - segment.start:]))
+
+    # the populated runs of the changed pages
+    for page, i in changed.items():
+        data = memoryview(delta.page_data(i))
+        pos = 0
+        for address, length in delta.pages[i]['runs']:
+            spans.append((address, data[pos: pos + length]))
+            pos += length
+
+    spans.sort(key=lambda span: span[0])
+    image = HexParser.from_spans(spans, page_size, record_size,
+                                 delta.start_linear_addr, delta.start_segment_addr)
+
+    for page, i in changed.items():
+        if page_crc(image, page * page_size, page_size) != delta.pages[i]['new_crc']:
+            raise ChecksumError("Page 0x%0.8X does not match its CRC after applying the delta!" % (page * page_size))
+    return image
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                         description='Makes or applies a page granular delta between hex images.')
+    arg_parser.add_argument('files', nargs=3, help='<old.hex> <new.hex> <delta> or, with --apply, <old.hex> <delta> <output.hex>')
+    arg_parser.add_argument('--apply', action='store_true', help='apply the delta to the old image')
+    arg_parser.add_argument('-p', '--page-size', type=lambda x: int(x, 0), default=1024)
+    arg_parser.add_argument('--no-compress', action='store_true', help='do not compress the page data')
+    args = arg_parser.parse_args(argv[1:])
+
+    for file_name in args.files[0:2]:
+        if not os.path.exists(file_name):
+            sys.exit('ERROR: %s was not found!' % file_name)
+
+    try:
+        old = HexParser(args.files[0], args.page_size)
+        if args.apply:
+            f = open(args.files[1], 'rb')
+            delta = OtaDelta.from_bytes(f.read())
+            f.close()
+            apply_delta(old, delta).write_to_hex(args.files[2])
+            print("Applied %d pages" % len(delta.pages))
+        else:
+            delta = make_delta(old, HexParser(args.files[1], args.page_size), args.page_size, not args.no_compress)
+            data = delta.to_bytes()
+            f = open(args.files[2], 'wb')
+            f.write(data)
+            f.close()
+            print("%d pages changed, delta is %d bytes" % (len(delta.pages), len(data)))
+    except (AddressError, ChecksumError) as e:
+        sys.exit(e.value)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
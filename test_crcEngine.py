@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+'''
+Checks the table driven CRC32 of crcEngine.py bit for bit against the bitwise crc32()
+crcCalculation.py used before, for single buffers and chained Crc32.update calls.
+Usage: test_crcEngine.py
+'''
+
+import random
+import zlib
+from os.path import sys
+
+from crcEngine import Crc32, ZLIB_POLYNOM, crc32
+
+polynom = 0xEB31D82E
+
+
+def crc32_bitwise(data, acc, polynom=polynom):
+    """
+    The previous crc32() from crcCalculation.py, one byte per call.
+    ctypes.c_ulong is 32 bits wide on the Windows machines the script ran on,
+    the masks below keep that behaviour on every platform.
+    """
+    acc = ~acc & 0xFFFFFFFF
+    acc = acc ^ data
+    for i in range(0, 8):
+        m = -(acc & 1)
+        acc = (acc >> 1) ^ (polynom & m)
+    return ~acc & 0xFFFFFFFF
+
+
+def bitwise(buffer, polynom=polynom):
+    acc = 0
+    for byte in buffer:
+        acc = crc32_bitwise(byte, acc, polynom)
+    return acc
+
+
+def check(name, value, expected):
+    if value != expected:
+        sys.exit("ERROR: %s is 0x%0.8X, expected 0x%0.8X" % (name, value, expected))
+
+
+def main(argv):
+    rnd = random.Random(0)
+    for length in (0, 1, 3, 4, 5, 64, 1000):
+        buffer = rnd.randbytes(length)
+        expected = bitwise(buffer)
+        check("crc32 of %d bytes" % length, crc32(buffer, polynom), expected)
+
+        split = length // 3
+        check("Crc32.update of %d bytes in 2 parts" % length,
+              Crc32(polynom).update(buffer[:split]).update(buffer[split:]).value, expected)
+
+        crc = Crc32(polynom)
+        for byte in buffer:
+            crc.update(bytes([byte]))
+        check("Crc32.update of %d bytes one by one" % length, crc.value, expected)
+
+        check("crc32 of %d bytes with the zlib polynomial" % length,
+              crc32(buffer, ZLIB_POLYNOM), bitwise(buffer, ZLIB_POLYNOM))
+        check("zlib.crc32 of %d bytes" % length, zlib.crc32(buffer), bitwise(buffer, ZLIB_POLYNOM))
+
+    print("table driven CRC32 matches the bitwise implementation")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))